@@ -0,0 +1,214 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import ils_grasp
+
+try:
+    import resource
+except ImportError:
+    # Windows: sem getrusage, o pico de memória dos workers não é medido
+    resource = None
+
+# =============================================================================
+# Gerador sintético de armazém (caixas e estoque) com semente
+# =============================================================================
+TIERS = {
+    "pequeno": {"num_boxes": 200, "num_skus": 500},
+    "medio": {"num_boxes": 1000, "num_skus": 2000},
+    "grande": {"num_boxes": 4000, "num_skus": 8000},
+}
+
+def generate_warehouse(num_boxes, num_skus, num_corridors=170, num_floors=2, corridor_spread=10,
+                       num_classes=6, class_skew=1.5, mean_items=8, max_pieces=10, stock_slack=1.5, seed=0):
+    """
+    Gera caixas e estoque nas mesmas estruturas de preprocess_boxes/preprocess_stock.
+    - corridor_spread: desvio (em corredores) das posições de um SKU em torno do seu
+      corredor de referência;
+    - class_skew: expoente de Zipf da distribuição de caixas por CLASSE_ONDA;
+    - mean_items: média (geométrica) de SKUs distintos por caixa;
+    - max_pieces: peças por SKU em cada caixa, uniforme em [1, max_pieces].
+    O estoque de cada SKU cobre a demanda total multiplicada por stock_slack.
+    """
+    rng = random.Random(seed)
+    class_names = [f"CLASSE_ONDA_{k + 1}" for k in range(num_classes)]
+    class_weights = [1 / (k + 1) ** class_skew for k in range(num_classes)]
+    skus = [f"SKU_{k + 1}" for k in range(num_skus)]
+    boxes = []
+    demand = defaultdict(int)
+    for caixa_id in range(1, num_boxes + 1):
+        num_items = min(num_skus, 1 + int(rng.expovariate(1 / max(mean_items - 1, 1e-9))))
+        items = {}
+        for sku in rng.sample(skus, num_items):
+            items[sku] = rng.randint(1, max_pieces)
+            demand[sku] += items[sku]
+        boxes.append({"caixa_id": caixa_id, "classe_onda": rng.choices(class_names, class_weights)[0], "items": items})
+    stock = defaultdict(list)
+    for sku in skus:
+        home = rng.randint(1, num_corridors)
+        total = max(1, int(demand[sku] * stock_slack))
+        num_positions = rng.randint(1, 6)
+        cuts = sorted(rng.randint(0, total) for _ in range(num_positions - 1))
+        for qty in (b - a for a, b in zip([0] + cuts, cuts + [total])):
+            if qty > 0:
+                corredor = min(num_corridors, max(1, int(rng.gauss(home, corridor_spread))))
+                stock[sku].append((rng.randrange(num_floors), corredor, qty))
+        stock[sku].sort(key=lambda x: -x[2])
+    return boxes, stock
+
+# =============================================================================
+# Medição das etapas: tempo, pico de memória e qualidade
+# =============================================================================
+def measure(stage, func, *args, track_memory=True, **kwargs):
+    if track_memory:
+        tracemalloc.start()
+    cache_before = ils_grasp.area_cache_stats()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    cache_after = ils_grasp.area_cache_stats()
+    metrics = {"stage": stage, "seconds": round(elapsed, 4),
+               "area_cache_hits": cache_after["hits"] - cache_before["hits"],
+               "area_cache_misses": cache_after["misses"] - cache_before["misses"]}
+    if track_memory:
+        metrics["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return result, metrics
+
+def wave_quality(waves):
+    total_area = sum(w.area() for w in waves)
+    return {"waves": len(waves), "wave_area": total_area, "wave_cost": ils_grasp.wave_solution_cost(waves)}
+
+def children_maxrss_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(maxrss / (2 ** 20 if sys.platform == "darwin" else 1024), 2)
+
+def parallel_stage(aggregated, grasp_iter, num_workers, seed):
+    """
+    Etapa parallel_grasp com num_workers, executada em um processo novo por nº de
+    workers: ru_maxrss de RUSAGE_CHILDREN é o maior RSS entre os filhos já encerrados,
+    e em um processo exclusivo ele reflete só os workers deste pool. O pico de memória
+    dos workers não aparece no tracemalloc. ru_maxrss vem em KiB no Linux e em bytes
+    no macOS (children_maxrss_mb é convertido conforme sys.platform); sem o módulo
+    resource (Windows), children_maxrss_mb fica None.
+    """
+    by_class, metrics = measure("parallel_grasp", ils_grasp.parallel_grasp_grouping, aggregated,
+                                iterations=grasp_iter, max_workers=num_workers, seed=seed, track_memory=False)
+    metrics["workers"] = num_workers
+    metrics["children_maxrss_mb"] = children_maxrss_mb()
+    metrics.update(wave_quality([w for waves_class in by_class.values() for w in waves_class]))
+    return metrics
+
+def run_tier(tier, params, workers, seed, ils_iter, grasp_iter, track_memory):
+    boxes, stock = generate_warehouse(seed=seed, **params)
+    stages = []
+    (solution, _), metrics = measure("greedy", ils_grasp.allocate_boxes_greedy, boxes, stock, track_memory=track_memory)
+    metrics["area"] = ils_grasp.cost_solution(solution)
+    stages.append(metrics)
+    (batch_solution, _), metrics = measure("batch", ils_grasp.allocate_boxes_batch, boxes, stock, track_memory=track_memory)
+    metrics["area"] = ils_grasp.cost_solution(batch_solution)
+    stages.append(metrics)
+    refined, metrics = measure("ils", ils_grasp.ils_refine_solution, solution, stock, max_iter=ils_iter,
+                               perturbation_strength=0.2, rng=ils_grasp.derive_rng(seed, "ils"), track_memory=track_memory)
+    metrics["area"] = ils_grasp.cost_solution(refined)
+    stages.append(metrics)
+    aggregated, metrics = measure("aggregate", ils_grasp.aggregate_boxes, refined, track_memory=track_memory)
+    stages.append(metrics)
+    waves, metrics = measure("grasp", ils_grasp.grasp_group_boxes_into_waves, aggregated, iterations=grasp_iter,
+                             rng=ils_grasp.derive_rng(seed, "grasp"), track_memory=track_memory)
+    metrics.update(wave_quality(waves))
+    stages.append(metrics)
+    for num_workers in workers:
+        with ProcessPoolExecutor(max_workers=1) as runner:
+            stages.append(runner.submit(parallel_stage, aggregated, grasp_iter, num_workers, seed).result())
+    return {
+        "tier": tier,
+        "params": params,
+        "rows": len(solution),
+        "stages": stages,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# =============================================================================
+# Comparação entre dois arquivos de resultados
+# =============================================================================
+def compare_results(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def index(results):
+        return {(r["tier"], s["stage"], s.get("workers")): s for r in results["results"] for s in r["stages"]}
+
+    old_stages, new_stages = index(old), index(new)
+    print(f"{'tier':<10}{'etapa':<16}{'workers':>8}{'antes (s)':>12}{'depois (s)':>12}{'razão':>8}  qualidade")
+    for key in sorted(new_stages, key=str):
+        if key not in old_stages:
+            continue
+        a, b = old_stages[key], new_stages[key]
+        ratio = b["seconds"] / a["seconds"] if a["seconds"] else float("inf")
+        quality = {q: (a[q], b[q]) for q in ("area", "wave_cost", "waves") if q in b and q in a and a[q] != b[q]}
+        print(f"{key[0]:<10}{key[1]:<16}{str(key[2] or ''):>8}{a['seconds']:>12.3f}{b['seconds']:>12.3f}{ratio:>8.2f}  {quality or ''}")
+
+# =============================================================================
+# Execução
+# =============================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de alocação, ILS e GRASP em dados sintéticos.")
+    parser.add_argument("--tiers", nargs="+", default=list(TIERS), choices=list(TIERS))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ils-iter", type=int, default=1)
+    parser.add_argument("--grasp-iter", type=int, default=2)
+    parser.add_argument("--corridor-spread", type=int, default=10)
+    parser.add_argument("--class-skew", type=float, default=1.5)
+    parser.add_argument("--mean-items", type=float, default=8)
+    parser.add_argument("--num-skus", type=int, help="nº de SKUs do armazém (padrão: o do tamanho escolhido)")
+    parser.add_argument("--max-pieces", type=int, default=10, help="peças por SKU em cada caixa, uniforme em [1, max]")
+    parser.add_argument("--no-memory", action="store_true", help="não mede pico de memória (tracemalloc deixa as etapas mais lentas)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DEPOIS"), help="compara dois arquivos de resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        results = []
+        for tier in args.tiers:
+            params = dict(TIERS[tier], corridor_spread=args.corridor_spread, class_skew=args.class_skew, mean_items=args.mean_items,
+                          max_pieces=args.max_pieces)
+            if args.num_skus is not None:
+                params["num_skus"] = args.num_skus
+            result = run_tier(tier, params, args.workers, args.seed, args.ils_iter, args.grasp_iter, not args.no_memory)
+            for stage in result["stages"]:
+                print(tier, json.dumps(stage))
+            results.append(result)
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "ils_iter": args.ils_iter,
+            "grasp_iter": args.grasp_iter,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados salvos em: {args.output}")
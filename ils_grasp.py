@@ -1,26 +1,126 @@
+import numpy as np
 import pandas as pd
+import argparse
+import contextlib
 import copy
+import csv
+import cProfile
+import gc
+import hashlib
+import itertools
+import json
+import os
 import random
+from bisect import bisect_left, insort
 from collections import defaultdict
+from functools import lru_cache
 from math import floor
 import re
+import shutil
+import sys
+import tempfile
 import time
+import tracemalloc
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+try:
+    import pyarrow  # noqa: F401  (leitor de CSV opcional, mais rápido)
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# =============================================================================
+# Instrumentação: temporizadores por etapa e eventos em JSON lines
+# =============================================================================
+class Metrics:
+    """
+    Grava eventos estruturados (um JSON por linha) em vez de prints. Sem arquivo
+    configurado, emit não faz nada. Opcionalmente mede o pico de memória de cada
+    etapa com tracemalloc e captura um perfil cProfile da execução. Em Python 3.8 não
+    há tracemalloc.reset_peak: o pico registrado é o acumulado desde o início.
+    """
+    def __init__(self, path=None, trace_memory=False, profile_path=None):
+        self.stream = open(path, "a", encoding="utf-8") if path else None
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.profiler = cProfile.Profile() if profile_path else None
+        if trace_memory:
+            tracemalloc.start()
+        if self.profiler:
+            self.profiler.enable()
+
+    def emit(self, event, **fields):
+        if self.stream is None:
+            return
+        record = {"ts": round(time.time(), 3), "event": event}
+        record.update(fields)
+        self.stream.write(json.dumps(record, default=str) + "\n")
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        if self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            fields["seconds"] = round(time.perf_counter() - start, 4)
+            if self.trace_memory:
+                fields["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            self.emit("stage", stage=name, **fields)
+
+    def close(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.emit("profile", path=self.profile_path)
+        if self.trace_memory:
+            tracemalloc.stop()
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+NO_METRICS = Metrics()
 
 # =============================================================================
 # Função auxiliar para cálculo da área (usa apenas os pares únicos)
 # =============================================================================
-def area_side(corridors):
-    if not corridors:
+AREA_CACHE_SIZE = 1 << 16  # Nº máximo de assinaturas com área memorizada
+
+def corridor_signature(corridors):
+    """
+    Assinatura de uma lista de alocações (andar, corredor, qtd): o frozenset dos pares
+    (andar, corredor) distintos, sem ordenação. Alocações que visitam as mesmas
+    posições têm a mesma assinatura, qualquer que seja a quantidade ou a ordem. Uma
+    alocação de posição única (o caso comum nas linhas do ILS) vira a tupla com o seu
+    par, mais barata de montar; a área é a mesma nos dois formatos.
+    """
+    if len(corridors) == 1:
+        fl, corr, _ = corridors[0]
+        return ((fl, corr),)
+    return frozenset([(fl, corr) for fl, corr, _ in corridors])
+
+@lru_cache(maxsize=AREA_CACHE_SIZE)
+def signature_area(signature):
+    if not signature:
         return 0
-    # Obtém os pares (andar, corredor) sem duplicação
-    unique_pairs = set((fl, corr) for fl, corr, _ in corridors)
-    sorted_corr = sorted([pair[1] for pair in unique_pairs])
-    if not sorted_corr:
+    corridors = [corr for _, corr in signature]
+    return area_from_stats(len(signature), min(corridors), max(corridors))
+
+def area_side(corridors):
+    return signature_area(corridor_signature(corridors))
+
+def area_cache_stats():
+    info = signature_area.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+def area_from_stats(actual_count, min_corr, max_corr):
+    # Mesma regra de area_side, a partir do nº de pares únicos e dos corredores extremos
+    if actual_count == 0:
         return 0
-    actual_count = len(sorted_corr)
-    ideal_count = (sorted_corr[-1] - sorted_corr[0]) // 2 + 1
-    return actual_count if actual_count >= ideal_count else sorted_corr[-1] - sorted_corr[0]
+    ideal_count = (max_corr - min_corr) // 2 + 1
+    return actual_count if actual_count >= ideal_count else max_corr - min_corr
 
 # =============================================================================
 # Função de custo: soma das áreas de todas as caixas
@@ -69,33 +169,100 @@ def allocate_sku_greedy(sku, required, stock):
 # Pré-processamento: caixas e estoque
 # =============================================================================
 def load_data(caixas_path, estoque_path):
-    caixas_df = pd.read_csv(caixas_path)
-    estoque_df = pd.read_csv(estoque_path)
+    caixas_df = pd.read_csv(caixas_path, engine=CSV_ENGINE)
+    estoque_df = pd.read_csv(estoque_path, engine=CSV_ENGINE)
     return caixas_df, estoque_df
 
+def intern_skus(sku_series):
+    """
+    Converte a coluna SKU em códigos inteiros (ordem de primeira aparição) e na lista
+    de nomes completos "SKU_..." correspondente. O prefixo é aplicado só uma vez por
+    valor distinto, e não a cada linha.
+    """
+    raw_codes, raw_values = pd.factorize(sku_series, sort=False, use_na_sentinel=False)
+    full_names = [str(v) if str(v).startswith("SKU_") else f"SKU_{v}" for v in raw_values]
+    name_codes, names = pd.factorize(pd.Series(full_names, dtype=object), sort=False)
+    return name_codes[raw_codes], list(names)
+
 def preprocess_boxes(caixas_df):
-    boxes = {}
-    for _, row in caixas_df.iterrows():
-        caixa_id = row["CAIXA_ID"]
-        sku = row["SKU"]
-        sku_full = f"SKU_{sku}" if not str(sku).startswith("SKU_") else str(sku)
-        quantidade = row["PECAS"]
-        classe = row["CLASSE_ONDA"]
-        if caixa_id not in boxes:
-            boxes[caixa_id] = {"caixa_id": caixa_id, "classe_onda": classe, "items": {}}
-        boxes[caixa_id]["items"][sku_full] = boxes[caixa_id]["items"].get(sku_full, 0) + quantidade
-    return list(boxes.values())
+    box_codes, box_ids = pd.factorize(caixas_df["CAIXA_ID"], sort=False)
+    sku_codes, sku_names = intern_skus(caixas_df["SKU"])
+    # Classe de cada caixa: a da primeira linha em que ela aparece
+    _, first_rows = np.unique(box_codes, return_index=True)
+    classes = caixas_df["CLASSE_ONDA"].to_numpy()[first_rows].tolist()
+    boxes = [{"caixa_id": caixa_id, "classe_onda": classe, "items": {}}
+             for caixa_id, classe in zip(box_ids.tolist(), classes)]
+    # Soma das peças por (caixa, SKU), na ordem de primeira aparição
+    totals = caixas_df["PECAS"].groupby([box_codes, sku_codes], sort=False).sum()
+    for (box_code, sku_code), quantidade in zip(totals.index.tolist(), totals.tolist()):
+        boxes[box_code]["items"][sku_names[sku_code]] = quantidade
+    return boxes
 
 def preprocess_stock(estoque_df):
+    sku_codes, sku_names = intern_skus(estoque_df["SKU"])
+    pecas = estoque_df["PECAS"].to_numpy()
+    # Ordena por SKU e, dentro de cada SKU, por quantidade decrescente (estável)
+    order = np.lexsort((np.arange(len(pecas)), -pecas, sku_codes))
+    andares = estoque_df["ANDAR"].to_numpy()[order].tolist()
+    corredores = estoque_df["CORREDOR"].to_numpy()[order].tolist()
+    quantidades = pecas[order].tolist()
+    bounds = np.searchsorted(sku_codes[order], np.arange(len(sku_names) + 1)).tolist()
     stock = defaultdict(list)
-    for _, row in estoque_df.iterrows():
-        sku = row["SKU"]
-        sku_full = f"SKU_{sku}" if not str(sku).startswith("SKU_") else str(sku)
-        stock[sku_full].append((row["ANDAR"], row["CORREDOR"], row["PECAS"]))
-    for sku in stock:
-        stock[sku].sort(key=lambda x: -x[2])
+    for code, sku in enumerate(sku_names):
+        start, end = bounds[code], bounds[code + 1]
+        stock[sku] = list(zip(andares[start:end], corredores[start:end], quantidades[start:end]))
     return stock
 
+# =============================================================================
+# Leitura em fluxo do arquivo de caixas, com despejo em disco por classe
+# =============================================================================
+def spill_boxes_by_class(caixas_path, spill_dir, chunksize=200000):
+    """
+    Lê o arquivo de caixas em blocos de linhas e grava as caixas concluídas em um
+    arquivo JSON lines por CLASSE_ONDA. As linhas da última caixa de cada bloco seguem
+    para o bloco seguinte; se uma caixa reaparecer mais adiante no arquivo, os registros
+    parciais são combinados em load_class_boxes. Retorna {classe: caminho do arquivo}.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    paths = {}
+    files = {}
+
+    def spill(boxes):
+        for box in boxes:
+            cls = box["classe_onda"]
+            if cls not in files:
+                paths[cls] = os.path.join(spill_dir, re.sub(r"[^\w.-]", "_", str(cls)) + ".jsonl")
+                files[cls] = open(paths[cls], "w", encoding="utf-8")
+            files[cls].write(json.dumps(box) + "\n")
+
+    carry = None
+    try:
+        for chunk in pd.read_csv(caixas_path, chunksize=chunksize):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            open_rows = chunk["CAIXA_ID"] == chunk["CAIXA_ID"].iloc[-1]
+            carry = chunk[open_rows]
+            spill(preprocess_boxes(chunk[~open_rows]))
+        if carry is not None:
+            spill(preprocess_boxes(carry))
+    finally:
+        for f in files.values():
+            f.close()
+    return paths
+
+def load_class_boxes(path):
+    boxes = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            box = json.loads(line)
+            cid = box["caixa_id"]
+            if cid not in boxes:
+                boxes[cid] = box
+            else:
+                for sku, qty in box["items"].items():
+                    boxes[cid]["items"][sku] = boxes[cid]["items"].get(sku, 0) + qty
+    return list(boxes.values())
+
 # =============================================================================
 # Validação Global do Estoque
 # =============================================================================
@@ -135,121 +302,532 @@ def allocate_boxes_greedy(boxes, stock):
             })
     return solution, stock_alloc
 
+# =============================================================================
+# Alocação em lote: todas as demandas de um SKU atendidas de uma vez
+# =============================================================================
+def box_preferred_corridors(boxes, stock):
+    """
+    Corredores preferidos de cada caixa: os das posições principais (primeiras no
+    estoque, as de maior quantidade) dos seus SKUs, por onde a alocação gulosa já faz
+    a caixa passar. Só dependem do estoque original, então cada SKU pode ser alocado
+    de forma independente e ainda assim concentrar a caixa nos mesmos corredores.
+    """
+    return [{stock[sku][0][1] for sku in box["items"] if stock.get(sku)} for box in boxes]
+
+class FirstFitIndex:
+    """
+    Árvore de segmentos com o maior saldo de cada intervalo de posições de um SKU:
+    encontra em O(log n) a primeira posição (na ordem do estoque) cujo saldo comporta
+    uma quantidade, como o laço de allocate_sku_old, sem varrer a lista desde o início.
+    """
+    def __init__(self, quantities):
+        self.count = len(quantities)
+        self.size = 1
+        while self.size < self.count:
+            self.size *= 2
+        self.tree = [0] * (2 * self.size)
+        self.tree[self.size:self.size + self.count] = quantities
+        for k in range(self.size - 1, 0, -1):
+            self.tree[k] = max(self.tree[2 * k], self.tree[2 * k + 1])
+
+    def balance(self, i):
+        return self.tree[self.size + i]
+
+    def first_fit(self, qty):
+        # Sem posições, nem uma demanda de zero peças tem onde ficar
+        if self.count == 0 or self.tree[1] < qty:
+            return None
+        k = 1
+        while k < self.size:
+            k = 2 * k if self.tree[2 * k] >= qty else 2 * k + 1
+        return k - self.size
+
+    def take(self, i, qty):
+        k = self.size + i
+        self.tree[k] -= qty
+        k //= 2
+        while k:
+            self.tree[k] = max(self.tree[2 * k], self.tree[2 * k + 1])
+            k //= 2
+
+    def remaining(self):
+        return self.tree[self.size:self.size + self.count]
+
+LINEAR_SCAN_POSITIONS = 32  # Até este nº de posições, o SKU é alocado por varredura linear, sem a árvore
+
+def allocate_sku_linear(sku, entries, demands, preferred_corridors):
+    """
+    Mesmas regras de allocate_sku_batch, para SKUs com poucas posições: os saldos ficam
+    em uma lista e cada demanda varre as posições uma única vez (a primeira preferida
+    que comporte a demanda ou, na falta dela, a primeira que comporte).
+    """
+    if len(entries) == 1:
+        andar, corredor, qty = entries[0]
+        total = sum(demands)
+        if total > qty:
+            raise Exception(f"Estoque insuficiente para {sku}: falta {total - qty} peças")
+        return [[(andar, corredor, required)] for required in demands], [qty - total]
+    balances = [qty for _, _, qty in entries]
+    corridors = [corredor for _, corredor, _ in entries]
+    positions = range(len(entries))
+    allocations = []
+    for required, preferred in zip(demands, preferred_corridors):
+        i = None
+        first = None
+        for k in positions:
+            if balances[k] >= required:
+                if corridors[k] in preferred:
+                    i = k
+                    break
+                if first is None:
+                    first = k
+        if i is None:
+            i = first
+        if i is not None:
+            balances[i] -= required
+            allocations.append([(entries[i][0], entries[i][1], required)])
+            continue
+        allocation = []
+        left = required
+        for k in positions:
+            if left == 0:
+                break
+            if balances[k] > 0:
+                qty = min(balances[k], left)
+                balances[k] -= qty
+                allocation.append((entries[k][0], entries[k][1], qty))
+                left -= qty
+        if left > 0:
+            raise Exception(f"Estoque insuficiente para {sku}: falta {left} peças")
+        allocations.append(allocation)
+    return allocations, balances
+
+def allocate_sku_batch(sku, entries, demands, preferred_corridors):
+    """
+    Atende, na ordem dada, as demandas de um SKU (peças pedidas por cada linha, com os
+    corredores preferidos da caixa da linha em preferred_corridors). Cada demanda vai
+    inteira para a primeira posição preferida que a comporte; sem ela, para a primeira
+    posição que a comporte (FirstFitIndex); senão, é dividida entre as posições na
+    ordem do estoque, como em allocate_sku_new.
+    SKUs com até LINEAR_SCAN_POSITIONS posições vão para allocate_sku_linear.
+    Retorna (alocação de cada demanda, saldo final de cada entrada do estoque).
+    """
+    if len(entries) <= LINEAR_SCAN_POSITIONS:
+        return allocate_sku_linear(sku, entries, demands, preferred_corridors)
+    index = FirstFitIndex([qty for _, _, qty in entries])
+    # Posições do SKU por corredor, na ordem do estoque: cada demanda só examina as
+    # posições dos seus corredores preferidos
+    positions_by_corridor = defaultdict(list)
+    for k, (_, corredor, _) in enumerate(entries):
+        positions_by_corridor[corredor].append(k)
+    allocations = []
+    for required, preferred in zip(demands, preferred_corridors):
+        i = None
+        for corredor in preferred:
+            for k in positions_by_corridor.get(corredor, ()):
+                if i is not None and k >= i:
+                    break
+                if index.balance(k) >= required:
+                    i = k
+                    break
+        if i is None:
+            i = index.first_fit(required)
+        if i is not None:
+            index.take(i, required)
+            allocations.append([(entries[i][0], entries[i][1], required)])
+            continue
+        allocation = []
+        left = required
+        while left > 0:
+            i = index.first_fit(1)
+            if i is None:
+                raise Exception(f"Estoque insuficiente para {sku}: falta {left} peças")
+            qty = min(index.balance(i), left)
+            index.take(i, qty)
+            allocation.append((entries[i][0], entries[i][1], qty))
+            left -= qty
+        allocations.append(allocation)
+    return allocations, index.remaining()
+
+def allocate_sku_group(group):
+    # Executa allocate_sku_batch para um grupo de SKUs (unidade de trabalho dos workers)
+    return [(sku, *allocate_sku_batch(sku, entries, demands, preferred)) for sku, entries, demands, preferred in group]
+
+@contextlib.contextmanager
+def gc_paused():
+    # Suspende o coletor cíclico: a alocação cria dezenas de milhares de dicts e listas
+    # sem ciclos, e cada coleta percorreria toda a solução ainda em construção
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def allocate_boxes_batch(boxes, stock, max_workers=1):
+    """
+    Alternativa a allocate_boxes_greedy: agrupa as demandas de todas as caixas por SKU
+    e aloca cada SKU em uma única passada (allocate_sku_batch), sem copiar o estoque
+    inteiro. Os SKUs são independentes e, com max_workers > 1, são distribuídos entre
+    processos; isso só compensa para SKUs com muitas posições, já que o custo de
+    serializar as demandas supera o da alocação na maioria dos casos.
+    Retorna (solução, estoque restante) no mesmo formato da versão gulosa, com as linhas
+    na mesma ordem.
+    """
+    with gc_paused():
+        solution = []
+        rows = defaultdict(list)
+        demands = defaultdict(list)
+        preferred = defaultdict(list)
+        for box, box_preferred in zip(boxes, box_preferred_corridors(boxes, stock)):
+            for sku, required in box["items"].items():
+                rows[sku].append(len(solution))
+                demands[sku].append(required)
+                preferred[sku].append(box_preferred)
+                solution.append({
+                    "caixa_id": box["caixa_id"],
+                    "classe_onda": box["classe_onda"],
+                    "sku": sku,
+                    "required": required,
+                    "allocations": None
+                })
+        work = [(sku, stock.get(sku, []), demands[sku], preferred[sku]) for sku in rows]
+        if max_workers > 1 and len(work) > 1:
+            groups = [work[k::max_workers] for k in range(max_workers)]
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = [r for group in executor.map(allocate_sku_group, groups) for r in group]
+        else:
+            results = allocate_sku_group(work)
+        stock_alloc = defaultdict(list, {sku: list(entries) for sku, entries in stock.items() if sku not in rows})
+        for sku, allocations, remaining in results:
+            for row, allocation in zip(rows[sku], allocations):
+                solution[row]["allocations"] = allocation
+            stock_alloc[sku] = [(andar, corredor, qty) for (andar, corredor, _), qty in zip(stock.get(sku, []), remaining)]
+        return solution, stock_alloc
+
+# =============================================================================
+# Livro-razão de estoque: uso incremental por SKU e posição (ANDAR, CORREDOR)
+# =============================================================================
+class StockLedger:
+    """
+    Mantém, para cada SKU, a quantidade disponível (estoque original) e a quantidade
+    já alocada em cada posição (ANDAR, CORREDOR). As consultas de estoque efetivo e de
+    viabilidade leem diretamente daqui, e cada realocação custa O(tamanho da alocação).
+    """
+    def __init__(self, original_stock, solution=()):
+        self.available = {}
+        self.allocated = defaultdict(lambda: defaultdict(int))
+        self.overflow = defaultdict(int)  # Nº de posições com alocado > disponível, por SKU
+        for sku, entries in original_stock.items():
+            positions = {}
+            for andar, corredor, qty in entries:
+                positions[(andar, corredor)] = positions.get((andar, corredor), 0) + qty
+            self.available[sku] = positions
+        for entry in solution:
+            self.allocate(entry["sku"], entry["allocations"])
+
+    def _is_over(self, sku, pos, used_qty):
+        return used_qty > self.available.get(sku, {}).get(pos, 0)
+
+    def is_position_over(self, sku, pos):
+        return self._is_over(sku, pos, self.allocated.get(sku, {}).get(pos, 0))
+
+    def _apply(self, sku, allocation, sign):
+        allocated = self.allocated[sku]
+        for andar, corredor, qty in allocation:
+            pos = (andar, corredor)
+            was_over = self._is_over(sku, pos, allocated[pos])
+            allocated[pos] += sign * qty
+            self.overflow[sku] += int(self._is_over(sku, pos, allocated[pos])) - int(was_over)
+
+    def allocate(self, sku, allocation):
+        self._apply(sku, allocation, 1)
+
+    def release(self, sku, allocation):
+        self._apply(sku, allocation, -1)
+
+    def reassign(self, sku, old_allocation, new_allocation):
+        self.release(sku, old_allocation)
+        self.allocate(sku, new_allocation)
+
+    def effective_stock(self, sku, allocation):
+        """
+        Estoque disponível para uma linha (caixa, SKU) desconsiderando a própria alocação.
+        """
+        allocated = self.allocated.get(sku, {})
+        this_alloc = defaultdict(int)
+        for andar, corredor, qty in allocation:
+            this_alloc[(andar, corredor)] += qty
+        effective_list = []
+        for (andar, corredor), avail in self.available.get(sku, {}).items():
+            qty = avail - (allocated.get((andar, corredor), 0) - this_alloc.get((andar, corredor), 0))
+            if qty > 0:
+                effective_list.append((andar, corredor, qty))
+        return effective_list
+
+    def is_feasible(self, sku, current_allocation, candidate_allocation):
+        """
+        Verifica se trocar a alocação atual pela candidata mantém todas as posições do SKU
+        dentro do estoque disponível.
+        """
+        allocated = self.allocated.get(sku, {})
+        delta = defaultdict(int)
+        for andar, corredor, qty in current_allocation:
+            delta[(andar, corredor)] -= qty
+        for andar, corredor, qty in candidate_allocation:
+            delta[(andar, corredor)] += qty
+        overflow = self.overflow.get(sku, 0)
+        for pos, diff in delta.items():
+            used_qty = allocated.get(pos, 0)
+            overflow += int(self._is_over(sku, pos, used_qty + diff)) - int(self._is_over(sku, pos, used_qty))
+        return overflow == 0
+
 # =============================================================================
 # Função auxiliar para obter o estoque efetivo para um SKU para uma caixa específica
 # =============================================================================
-def get_effective_stock(sku, solution, box_index, original_stock):
-    global_allocated = defaultdict(int)
-    for i, box in enumerate(solution):
-        if box["sku"] == sku:
-            for (andar, corredor, qty) in box["allocations"]:
-                global_allocated[(andar, corredor)] += qty
-    global_available = defaultdict(int)
-    for (andar, corredor, qty) in original_stock.get(sku, []):
-        global_available[(andar, corredor)] += qty
-    this_box_alloc = defaultdict(int)
-    for (andar, corredor, qty) in solution[box_index]["allocations"]:
-        this_box_alloc[(andar, corredor)] += qty
-    effective = {}
-    for key, avail in global_available.items():
-        allocated_except = global_allocated.get(key, 0) - this_box_alloc.get(key, 0)
-        effective[key] = avail - allocated_except
-    effective_list = [(andar, corredor, qty) for ((andar, corredor), qty) in effective.items() if qty > 0]
-    return effective_list
+def get_effective_stock(sku, solution, box_index, ledger):
+    return ledger.effective_stock(sku, solution[box_index]["allocations"])
+
+# =============================================================================
+# Estado do ILS: custo incremental por linha e registro de desfazer
+# =============================================================================
+class SolutionState:
+    """
+    Solução corrente do ILS. Cada movimento atualiza o livro-razão de estoque e o custo
+    total a partir da variação de área da linha alterada. A assinatura de corredores de
+    cada linha (corridor_signature) é calculada uma vez por alocação e guardada em
+    signatures; a área sai direto de signature_area. O registro de desfazer guarda,
+    para cada linha alterada desde o último melhor, a alocação (e a assinatura) que ela
+    tinha naquele momento; assim o melhor pode ser restaurado sem copiar a solução inteira.
+    """
+    def __init__(self, solution, original_stock):
+        self.solution = solution
+        self.ledger = StockLedger(original_stock, solution)
+        self.signatures = [corridor_signature(entry["allocations"]) for entry in solution]
+        self.row_costs = [signature_area(signature) for signature in self.signatures]
+        self.total_cost = sum(self.row_costs)
+        self.best_cost = self.total_cost
+        self.undo_log = {}
+        self.counters = {}
+        self.reset_counters()
+
+    def assign(self, idx, allocation, signature=None):
+        # signature: assinatura já calculada pelo chamador para avaliar a alocação
+        if signature is None:
+            signature = corridor_signature(allocation)
+        entry = self.solution[idx]
+        self.ledger.reassign(entry["sku"], entry["allocations"], allocation)
+        self.undo_log.setdefault(idx, (entry["allocations"], self.signatures[idx]))
+        entry["allocations"] = allocation
+        self.signatures[idx] = signature
+        new_cost = signature_area(signature)
+        self.total_cost += new_cost - self.row_costs[idx]
+        self.row_costs[idx] = new_cost
+
+    def append(self, entry):
+        # Nova linha (caixa, SKU), já com a alocação, no fim da solução
+        self.solution.append(entry)
+        self.ledger.allocate(entry["sku"], entry["allocations"])
+        self.signatures.append(corridor_signature(entry["allocations"]))
+        self.row_costs.append(signature_area(self.signatures[-1]))
+        self.total_cost += self.row_costs[-1]
+
+    def reset_counters(self):
+        # Movimentos tentados/aceitos na iteração corrente
+        self.counters = dict.fromkeys(("perturb_tried", "perturb_accepted", "local_tried", "local_accepted"), 0)
+
+    def commit_best(self):
+        self.best_cost = self.total_cost
+        self.undo_log = {}
+
+    def restore_best(self):
+        undo_log, self.undo_log = self.undo_log, {}
+        for idx, (allocation, signature) in undo_log.items():
+            self.assign(idx, allocation, signature)
+        self.undo_log = {}
+
+def allocation_pairs(allocation):
+    return [(andar, corredor) for andar, corredor, _ in allocation]
+
+class BoxSolutionState(SolutionState):
+    """
+    Variante de SolutionState cujo custo é a soma das áreas das caixas inteiras (todas
+    as linhas de uma caixa juntas, como em aggregate_boxes), e não de cada linha. O
+    multiconjunto de (andar, corredor) de cada caixa é mantido em um Wave cujas
+    entradas são os índices das linhas, e cada movimento atualiza só a caixa alterada.
+    """
+    def __init__(self, solution, original_stock):
+        super().__init__(solution, original_stock)
+        self.footprints = {}
+        for i, entry in enumerate(solution):
+            if entry["caixa_id"] not in self.footprints:
+                self.footprints[entry["caixa_id"]] = Wave(entry["classe_onda"])
+            self.footprints[entry["caixa_id"]].add_entry(i, entry["required"], allocation_pairs(entry["allocations"]))
+        self.total_cost = sum(footprint.area() for footprint in self.footprints.values())
+        self.best_cost = self.total_cost
+
+    def assign(self, idx, allocation, signature=None):
+        entry = self.solution[idx]
+        footprint = self.footprints[entry["caixa_id"]]
+        total_cost = self.total_cost - footprint.area()
+        footprint.remove_entry(idx, entry["required"], allocation_pairs(entry["allocations"]))
+        footprint.add_entry(idx, entry["required"], allocation_pairs(allocation))
+        super().assign(idx, allocation, signature)
+        self.total_cost = total_cost + footprint.area()
+
+    def append(self, entry):
+        raise Exception("BoxSolutionState não aceita novas linhas; use SolutionState")
 
 # =============================================================================
 # Busca local (ILS) para refinar a solução, minimizando a área por caixa
 # =============================================================================
-def local_search_solution(solution, original_stock):
+def local_search_solution(solution, original_stock, state=None, indices=None):
+    if state is None:
+        state = SolutionState(solution, original_stock)
     improved = False
-    for i in range(len(solution)):
+    for i in (range(len(solution)) if indices is None else indices):
         box = solution[i]
-        current_cost = area_side(box["allocations"])
+        current_cost = state.row_costs[i]
         sku = box["sku"]
         required = box["required"]
-        effective_stock = get_effective_stock(sku, solution, i, original_stock)
+        effective_stock = get_effective_stock(sku, solution, i, state.ledger)
         temp_stock = {sku: effective_stock}
         candidate = allocate_sku_old(sku, required, temp_stock)
         if candidate is not None:
-            new_cost = area_side(candidate)
-            if new_cost < current_cost and is_candidate_feasible_for_sku(solution, i, candidate, original_stock):
-                box["allocations"] = candidate
+            state.counters["local_tried"] += 1
+            signature = corridor_signature(candidate)
+            new_cost = signature_area(signature)
+            if new_cost < current_cost and is_candidate_feasible_for_sku(solution, i, candidate, state.ledger):
+                state.assign(i, candidate, signature)
+                state.counters["local_accepted"] += 1
                 improved = True
     return solution, improved
 
-def is_candidate_feasible_for_sku(solution, box_index, candidate_allocation, original_stock):
-    sku = solution[box_index]["sku"]
-    usage = defaultdict(int)
-    for i, box in enumerate(solution):
-        if box["sku"] == sku:
-            if i == box_index:
-                for alloc in candidate_allocation:
-                    pos = (alloc[0], alloc[1])
-                    usage[pos] += alloc[2]
-            else:
-                for alloc in box["allocations"]:
-                    pos = (alloc[0], alloc[1])
-                    usage[pos] += alloc[2]
-    available = defaultdict(int)
-    for pos in original_stock.get(sku, []):
-        key = (pos[0], pos[1])
-        available[key] += pos[2]
-    for pos, used_qty in usage.items():
-        if used_qty > available.get(pos, 0):
-            return False
-    return True
-
-def ils_refine_solution(initial_solution, original_stock, max_iter=100, perturbation_strength=0.1):
-    current_solution = copy.deepcopy(initial_solution)
-    best_solution = copy.deepcopy(initial_solution)
-    best_cost = cost_solution(best_solution)
+def box_local_search(solution, state, indices=None):
+    """
+    Busca local a nível de caixa (state é um BoxSolutionState): cada linha é
+    reabastecida pela posição única do SKU que mais reduz a área da caixa inteira,
+    o que favorece corredores que a caixa já visita. Empates na área da caixa são
+    desfeitos pela área da própria linha e, depois, pela posição mais usada pelas
+    demais linhas do SKU (mantém a demanda concentrada para o agrupamento em ondas).
+    """
+    improved = False
+    for i in (range(len(solution)) if indices is None else indices):
+        entry = solution[i]
+        sku, required, current = entry["sku"], entry["required"], entry["allocations"]
+        footprint = state.footprints[entry["caixa_id"]]
+        current_pairs = allocation_pairs(current)
+        box_area = footprint.area()
+        used = state.ledger.allocated.get(sku, {})
+        best = (0, 0, 0, None)
+        for andar, corredor, qty in state.ledger.effective_stock(sku, current):
+            if qty < required:
+                continue
+            state.counters["local_tried"] += 1
+            candidate = [(andar, corredor, required)]
+            delta = (footprint.area_after(removed=current_pairs, added=[(andar, corredor)]) - box_area,
+                     1 - state.row_costs[i], -used.get((andar, corredor), 0))
+            if delta[:2] < (0, 0) and delta < best[:3]:
+                best = (*delta, candidate)
+        if best[3] is not None and state.ledger.is_feasible(sku, current, best[3]):
+            state.assign(i, best[3])
+            state.counters["local_accepted"] += 1
+            improved = True
+    return solution, improved
+
+def is_candidate_feasible_for_sku(solution, box_index, candidate_allocation, ledger):
+    entry = solution[box_index]
+    return ledger.is_feasible(entry["sku"], entry["allocations"], candidate_allocation)
+
+def ils_refine_solution(initial_solution, original_stock, max_iter=100, perturbation_strength=0.1,
+                        time_limit=None, max_stall=None, box_level=False, metrics=NO_METRICS, rng=None):
+    """
+    Com time_limit (segundos), para no fim da iteração em que o prazo vence e devolve a
+    melhor solução encontrada; com max_stall, para após max_stall iterações seguidas sem
+    melhora. max_iter=None deixa apenas esses critérios de parada.
+    Com box_level, o custo passa a ser a área de cada caixa inteira (BoxSolutionState):
+    a perturbação move linhas para uma posição única sorteada entre as que comportam a
+    demanda (de preferência em corredores que a caixa já visita), e a busca local é
+    box_local_search.
+    rng é o gerador (random.Random) das perturbações; sem ele, usa o módulo random global.
+    """
+    rng = random if rng is None else rng
+    if max_iter is None and time_limit is None and max_stall is None:
+        raise Exception("ILS sem critério de parada: informe max_iter, time_limit ou max_stall")
+    deadline = None if time_limit is None else time.time() + time_limit
+    # Única cópia da solução: toda nova solução é aceita como corrente e o melhor é
+    # recuperado ao final pelo registro de desfazer
+    solution = copy.deepcopy(initial_solution)
+    state = BoxSolutionState(solution, original_stock) if box_level else SolutionState(solution, original_stock)
     num_boxes = len(initial_solution)
-    for i in range(max_iter):
-        new_solution = copy.deepcopy(current_solution)
+    stall = 0
+    for i in (range(max_iter) if max_iter is not None else itertools.count()):
+        iteration_start = time.perf_counter()
+        previous_cost = state.total_cost
+        state.reset_counters()
         num_perturb = max(1, int(perturbation_strength * num_boxes))
-        indices = random.sample(range(num_boxes), num_perturb)
+        indices = rng.sample(range(num_boxes), num_perturb)
+        state.counters["perturb_tried"] = num_perturb
         for idx in indices:
-            box = new_solution[idx]
+            box = solution[idx]
             sku = box["sku"]
             required = box["required"]
-            effective_stock = get_effective_stock(sku, new_solution, idx, original_stock)
+            effective_stock = get_effective_stock(sku, solution, idx, state.ledger)
+            if box_level:
+                visited = {corredor for andar, corredor in state.footprints[box["caixa_id"]].corridor_counts}
+                positions = [(andar, corredor) for andar, corredor, qty in effective_stock if qty >= required]
+                positions = [p for p in positions if p[1] in visited] or positions
+                if positions:
+                    effective_stock = [(*rng.choice(positions), required)]
             temp_stock = {sku: effective_stock}
             candidate = allocate_sku_old(sku, required, temp_stock)
-            if candidate is not None and is_candidate_feasible_for_sku(new_solution, idx, candidate, original_stock):
-                box["allocations"] = candidate
+            if candidate is not None and is_candidate_feasible_for_sku(solution, idx, candidate, state.ledger):
+                state.assign(idx, candidate)
+                state.counters["perturb_accepted"] += 1
             else:
                 candidate = allocate_sku_new(sku, required, temp_stock)
-                if is_candidate_feasible_for_sku(new_solution, idx, candidate, original_stock):
-                    box["allocations"] = candidate
-        new_solution, _ = local_search_solution(new_solution, original_stock)
-        new_cost = cost_solution(new_solution)
-        if new_cost < best_cost:
-            best_cost = new_cost
-            best_solution = copy.deepcopy(new_solution)
-        current_solution = new_solution
-        print(f"Iteração {i+1}: custo = {new_cost}, melhor custo = {best_cost}")
-    return best_solution
+                if is_candidate_feasible_for_sku(solution, idx, candidate, state.ledger):
+                    state.assign(idx, candidate)
+                    state.counters["perturb_accepted"] += 1
+        if box_level:
+            box_local_search(solution, state)
+        else:
+            local_search_solution(solution, original_stock, state)
+        new_cost = state.total_cost
+        if new_cost < state.best_cost:
+            state.commit_best()
+            stall = 0
+        else:
+            stall += 1
+        metrics.emit("ils_iteration", iteration=i + 1, cost=new_cost, best_cost=state.best_cost,
+                     delta=new_cost - previous_cost, seconds=round(time.perf_counter() - iteration_start, 4),
+                     **state.counters)
+        if max_stall is not None and stall >= max_stall:
+            metrics.emit("ils_stop", reason="stall", iteration=i + 1)
+            break
+        if deadline is not None and time.time() >= deadline:
+            metrics.emit("ils_stop", reason="time_limit", iteration=i + 1)
+            break
+    state.restore_best()
+    return solution
 
 # =============================================================================
 # Função para salvar a solução final a nível de caixa em CSV
 # =============================================================================
+BOX_SOLUTION_COLUMNS = ["caixa_id", "classe_onda", "sku", "required", "andar", "corridor", "allocated_qty", "area"]
+
 def save_box_solution(solution, output_csv):
-    rows = []
-    for sol in solution:
-        for alloc in sol["allocations"]:
-            andar, corredor, qty = alloc
-            rows.append({
-                "caixa_id": sol["caixa_id"],
-                "classe_onda": sol["classe_onda"],
-                "sku": sol["sku"],
-                "required": sol["required"],
-                "andar": andar,
-                "corridor": corredor,
-                "allocated_qty": qty,
-                "area": area_side(sol["allocations"])
-            })
-    df = pd.DataFrame(rows)
-    df.to_csv(output_csv, index=False, encoding="utf-8")
+    # Uma linha por (caixa, SKU, posição), escrita direto no arquivo, sem DataFrame intermediário
+    with open(output_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(BOX_SOLUTION_COLUMNS)
+        writer.writerows(
+            (sol["caixa_id"], sol["classe_onda"], sol["sku"], sol["required"], andar, corredor, qty, area)
+            for sol in solution
+            for area in (area_side(sol["allocations"]),)
+            for andar, corredor, qty in sol["allocations"]
+        )
     print(f"CSV de solução a nível de caixa salvo em: {output_csv}")
 
 # =============================================================================
@@ -349,56 +927,492 @@ def aggregate_boxes(refined_solution):
 # =============================================================================
 # Classe Wave para agrupamento de caixas em ondas
 # =============================================================================
+def box_pairs(box):
+    return [(fl, corr) for fl, corr, _ in box["corridors"]]
+
+# Contagem de bits de um inteiro (int.bit_count só existe a partir do Python 3.10)
+popcount = getattr(int, "bit_count", None) or (lambda mask: bin(mask).count("1"))
+
+def pair_masks(pairs):
+    """
+    Conjunto de pares (andar, corredor) como bitsets: um inteiro por andar, com o bit
+    de cada corredor ligado, e a união dos corredores de todos os andares.
+    Retorna (((andar, máscara), ...), máscara de corredores).
+    """
+    masks = {}
+    for fl, corr in pairs:
+        masks[fl] = masks.get(fl, 0) | (1 << corr)
+    corridor_mask = 0
+    for mask in masks.values():
+        corridor_mask |= mask
+    return tuple(masks.items()), corridor_mask
+
+def mask_bounds(mask):
+    # Menor e maior corredor de uma máscara (None se vazia)
+    if not mask:
+        return None, None
+    return (mask & -mask).bit_length() - 1, mask.bit_length() - 1
+
 class Wave:
     def __init__(self, wave_class):
         self.wave_class = wave_class
-        self.boxes = []   # Cada caixa é um dict agregado
+        self.boxes = []   # Cada caixa é um dict agregado (ou um índice inteiro, no núcleo do GRASP)
         self.total_pieces = 0
-        self.corridors = []  # Concatenação de todas as alocações das caixas
+        # Estado compacto das posições visitadas: multiconjunto de (andar, corredor),
+        # os mesmos pares como bitsets por andar, a união dos corredores, os corredores
+        # extremos e a área corrente
+        self.corridor_counts = {}
+        self.floor_masks = {}
+        self.corridor_mask = 0
+        self.min_corridor = None
+        self.max_corridor = None
+        self._area = 0
+
+    def copy(self):
+        # Cópia independente do estado da onda; as caixas (dicts) são compartilhadas
+        other = Wave(self.wave_class)
+        other.boxes = list(self.boxes)
+        other.total_pieces = self.total_pieces
+        other.corridor_counts = dict(self.corridor_counts)
+        other.floor_masks = dict(self.floor_masks)
+        other.corridor_mask = self.corridor_mask
+        other._refresh()
+        return other
+
+    def _refresh(self):
+        self.min_corridor, self.max_corridor = mask_bounds(self.corridor_mask)
+        self._area = area_from_stats(len(self.corridor_counts), self.min_corridor, self.max_corridor)
 
     def add_box(self, box):
-        self.boxes.append(box)
-        self.total_pieces += box["pieces"]
-        self.corridors.extend(box["corridors"])
+        self.add_entry(box, box["pieces"], box_pairs(box))
+
+    def add_entry(self, entry, pieces, pairs):
+        self.boxes.append(entry)
+        self.total_pieces += pieces
+        for key in pairs:
+            count = self.corridor_counts.get(key, 0)
+            self.corridor_counts[key] = count + 1
+            if count == 0:
+                bit = 1 << key[1]
+                self.floor_masks[key[0]] = self.floor_masks.get(key[0], 0) | bit
+                self.corridor_mask |= bit
+        self._refresh()
+
+    def remove_entry(self, entry, pieces, pairs):
+        self.boxes.remove(entry)
+        self.total_pieces -= pieces
+        for key in pairs:
+            self.corridor_counts[key] -= 1
+            if self.corridor_counts[key] == 0:
+                del self.corridor_counts[key]
+                bit = 1 << key[1]
+                self.floor_masks[key[0]] &= ~bit
+                if not any(mask & bit for mask in self.floor_masks.values()):
+                    self.corridor_mask &= ~bit
+        self._refresh()
+
+    def absorb(self, other):
+        # Incorpora todas as caixas de outra onda, que fica vazia
+        self.boxes.extend(other.boxes)
+        self.total_pieces += other.total_pieces
+        for key, count in other.corridor_counts.items():
+            self.corridor_counts[key] = self.corridor_counts.get(key, 0) + count
+        for fl, mask in other.floor_masks.items():
+            self.floor_masks[fl] = self.floor_masks.get(fl, 0) | mask
+        self.corridor_mask |= other.corridor_mask
+        self._refresh()
+        other.__init__(other.wave_class)
 
     def area(self):
-        return area_side(self.corridors)
+        return self._area
+
+    def area_after(self, removed=(), added=()):
+        """
+        Área da onda se os pares removed saíssem e os pares added entrassem, sem alterá-la.
+        Só os pares que entram ou saem da onda mexem nos bitsets, dos quais saem os
+        corredores extremos.
+        """
+        delta = {}
+        for key in added:
+            delta[key] = delta.get(key, 0) + 1
+        for key in removed:
+            delta[key] = delta.get(key, 0) - 1
+        count = len(self.corridor_counts)
+        gained = 0
+        lost_pairs = []
+        lost_extreme = False
+        for key, diff in delta.items():
+            current = self.corridor_counts.get(key, 0)
+            if current == 0 and diff > 0:
+                count += 1
+                gained |= 1 << key[1]
+            elif current > 0 and current + diff <= 0:
+                count -= 1
+                lost_pairs.append(key)
+                lost_extreme = lost_extreme or key[1] == self.min_corridor or key[1] == self.max_corridor
+        if count == 0:
+            return 0
+        if not lost_extreme and not gained:
+            return area_from_stats(count, self.min_corridor, self.max_corridor)
+        # Corredores que deixam de ser visitados só importam se um extremo for perdido
+        lost = 0
+        if lost_extreme:
+            for _, corr in lost_pairs:
+                if not any(self.corridor_counts.get((fl, corr), 0) + delta.get((fl, corr), 0) > 0 for fl in self.floor_masks):
+                    lost |= 1 << corr
+        lo, hi = mask_bounds((self.corridor_mask & ~lost) | gained)
+        return area_from_stats(count, lo, hi)
+
+    def incremental_area(self, box):
+        return self.incremental_area_pairs(box_pairs(box))
+
+    def incremental_area_pairs(self, pairs):
+        return self.incremental_area_masks(*pair_masks(pairs))
+
+    def incremental_area_masks(self, masks, corridor_mask):
+        """
+        Variação de área ao inserir a caixa dada pelos bitsets de pair_masks: os pares
+        novos são a contagem de bits da caixa fora da onda, andar a andar, e os
+        corredores extremos saem do menor e do maior bit da união.
+        """
+        new_pairs = 0
+        for fl, mask in masks:
+            new_pairs += popcount(mask & ~self.floor_masks.get(fl, 0))
+        lo, hi = mask_bounds(self.corridor_mask | corridor_mask)
+        return area_from_stats(len(self.corridor_counts) + new_pairs, lo, hi) - self._area
+
+# =============================================================================
+# Índice de ondas abertas por classe, ordenado pela capacidade restante
+# =============================================================================
+class OpenWaveIndex:
+    """
+    Para cada classe, mantém as ondas abertas em uma lista ordenada por
+    (capacidade restante, ordem de criação). As ondas viáveis para uma caixa saem de
+    uma busca por intervalo, e ondas que não comportam mais nenhuma caixa restante
+    da classe são aposentadas do índice.
+    """
+    def __init__(self, wave_capacity):
+        self.wave_capacity = wave_capacity
+        self.by_class = defaultdict(list)
+        self.order = {}
+
+    def _key(self, wave):
+        return (self.wave_capacity - wave.total_pieces, self.order[id(wave)])
+
+    def add(self, wave):
+        self.order.setdefault(id(wave), len(self.order))
+        insort(self.by_class[wave.wave_class], (*self._key(wave), wave))
+
+    def remove(self, wave):
+        entries = self.by_class[wave.wave_class]
+        del entries[bisect_left(entries, self._key(wave))]
+
+    def feasible(self, wave_class, pieces):
+        # Mantém a ordem de criação das ondas, como no filtro linear original
+        entries = self.by_class.get(wave_class, [])
+        candidates = entries[bisect_left(entries, (pieces,)):]
+        return [w for _, _, w in sorted(candidates, key=lambda entry: entry[1])]
+
+    def retire(self, wave_class, min_pieces):
+        entries = self.by_class.get(wave_class, [])
+        del entries[:bisect_left(entries, (min_pieces,))]
+
+def remaining_min_pieces(order, classes, pieces):
+    """
+    Para cada posição da ordem de inserção, a menor quantidade de peças entre as
+    caixas seguintes da mesma classe (infinito se não houver nenhuma).
+    """
+    running = {}
+    result = [0] * len(order)
+    for i in range(len(order) - 1, -1, -1):
+        cls = classes[order[i]]
+        result[i] = running.get(cls, float('inf'))
+        running[cls] = min(result[i], pieces[order[i]])
+    return result
+
+# =============================================================================
+# Afinidade de corredores: agrupamento das caixas antes da construção das ondas
+# =============================================================================
+def corridor_matrix(pairs):
+    """
+    Matriz esparsa caixa x corredor em formato CSR: offsets (len(pairs) + 1) e os
+    corredores distintos de cada caixa, em ordem crescente.
+    """
+    rows = [sorted({corr for _, corr in box}) for box in pairs]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    corridors = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=int(offsets[-1]))
+    return offsets, corridors
+
+def corridor_affinity_clusters(pairs, cluster_width=8):
+    """
+    Cluster de cada caixa pelo seu intervalo [min, max] de corredores: a faixa de
+    cluster_width corredores que contém o ponto médio do intervalo. Caixas de
+    clusters vizinhos visitam trechos próximos do armazém e, juntas, formam ondas
+    de menor área. Caixas sem corredores ficam no cluster 0.
+    """
+    offsets, corridors = corridor_matrix(pairs)
+    lengths = np.diff(offsets)
+    clusters = np.zeros(len(pairs), dtype=np.int64)
+    filled = lengths > 0
+    if filled.any():
+        starts = offsets[:-1][filled]
+        lo = corridors[starts]
+        hi = corridors[starts + lengths[filled] - 1]
+        clusters[filled] = (lo + hi) // 2 // cluster_width
+    return clusters.tolist()
+
+def affinity_order(order, clusters):
+    # Percorre as caixas cluster a cluster, mantendo a ordem aleatória dentro de cada um
+    return sorted(order, key=lambda idx: clusters[idx])
 
 # =============================================================================
 # Novo GRASP para agrupar caixas em ondas
 # =============================================================================
-def grasp_group_boxes_into_waves(aggregated_boxes, iterations=50, alpha=0.3, wave_capacity=6000):
+WAVE_PENALTY = 10  # Custo fixo por onda aberta
+
+def wave_solution_cost(waves):
+    total_area = sum(w.area() for w in waves)
+    return total_area + len(waves) * WAVE_PENALTY
+
+# =============================================================================
+# Busca local sobre as ondas construídas (merge, relocate e swap)
+# =============================================================================
+def wave_midpoint(wave):
+    # Corredor médio da onda; ondas só com caixas sem corredores ficam em -1
+    return -1 if wave.min_corridor is None else (wave.min_corridor + wave.max_corridor) // 2
+
+def pairs_midpoint(pairs):
+    corridors = [corr for _, corr in pairs]
+    return (min(corridors) + max(corridors)) // 2 if corridors else -1
+
+class WaveNeighborhood:
+    """
+    Ondas de uma classe ordenadas pelo corredor médio, fixado no início de cada
+    passada da busca local. near(midpoint) devolve as 2 * radius ondas mais próximas
+    desse corredor na ordenação: cada movimento avalia no máximo esse nº de ondas
+    parceiras, e o trabalho de uma passada fica linear no nº de caixas.
+    """
+    def __init__(self, class_waves, radius):
+        ordered = sorted(class_waves, key=wave_midpoint)
+        self.waves = ordered
+        self.midpoints = [wave_midpoint(w) for w in ordered]
+        self.radius = radius
+
+    def near(self, midpoint):
+        pos = bisect_left(self.midpoints, midpoint)
+        return self.waves[max(0, pos - self.radius):pos + self.radius]
+
+def merge_waves_pass(class_waves, wave_capacity, neighborhood):
+    improved = False
+    for source in neighborhood.waves:
+        if not source.boxes:
+            continue
+        for target in neighborhood.near(wave_midpoint(source)):
+            if target is source or not target.boxes or target.total_pieces + source.total_pieces > wave_capacity:
+                continue
+            merged_area = target.area_after(added=list(source.corridor_counts))
+            if merged_area - target.area() - source.area() - WAVE_PENALTY < 0:
+                target.absorb(source)
+                improved = True
+                break
+    return improved
+
+def relocate_pass(class_waves, pieces, pairs, masks, wave_capacity, neighborhood):
+    improved = False
+    for source in class_waves:
+        for entry in list(source.boxes):
+            removal = source.area_after(removed=pairs[entry]) - source.area()
+            if len(source.boxes) == 1:
+                removal -= WAVE_PENALTY
+            best = None
+            for target in neighborhood.near(pairs_midpoint(pairs[entry])):
+                if target is source or not target.boxes or target.total_pieces + pieces[entry] > wave_capacity:
+                    continue
+                delta = removal + target.incremental_area_masks(*masks[entry])
+                if delta < 0 and (best is None or delta < best[0]):
+                    best = (delta, target)
+            if best is not None:
+                source.remove_entry(entry, pieces[entry], pairs[entry])
+                best[1].add_entry(entry, pieces[entry], pairs[entry])
+                improved = True
+    return improved
+
+def swap_pass(class_waves, pieces, pairs, wave_capacity, swap_candidates, neighborhood):
+    # Candidatas de cada onda, dos dois lados da troca: as caixas cuja saída mais
+    # reduz a área da onda
+    candidates = {}
+    owner = {}
+    for wave in class_waves:
+        gains = sorted(wave.boxes, key=lambda e: wave.area_after(removed=pairs[e]) - wave.area())
+        candidates[id(wave)] = gains[:swap_candidates]
+        for entry in wave.boxes:
+            owner[entry] = wave
+    improved = False
+    for first in class_waves:
+        for a in candidates[id(first)]:
+            if owner[a] is not first:
+                continue
+            swapped = False
+            for second in neighborhood.near(pairs_midpoint(pairs[a])):
+                if second is first or not second.boxes:
+                    continue
+                for b in candidates[id(second)]:
+                    if owner[b] is not second:
+                        continue
+                    if first.total_pieces - pieces[a] + pieces[b] > wave_capacity or second.total_pieces - pieces[b] + pieces[a] > wave_capacity:
+                        continue
+                    delta = (first.area_after(removed=pairs[a], added=pairs[b]) - first.area()
+                             + second.area_after(removed=pairs[b], added=pairs[a]) - second.area())
+                    if delta < 0:
+                        first.remove_entry(a, pieces[a], pairs[a])
+                        second.remove_entry(b, pieces[b], pairs[b])
+                        first.add_entry(b, pieces[b], pairs[b])
+                        second.add_entry(a, pieces[a], pairs[a])
+                        owner[a], owner[b] = second, first
+                        swapped = improved = True
+                        break
+                if swapped:
+                    break
+    return improved
+
+def improve_waves_local_search(waves, pieces, pairs, wave_capacity=6000, max_passes=3, swap_candidates=5,
+                               neighbor_radius=8, deadline=None):
+    """
+    Busca local sobre ondas de índices de caixas, dentro de cada classe:
+    - merge: une duas ondas que cabem juntas na capacidade;
+    - relocate: move uma caixa para a onda da mesma classe com maior redução de custo;
+    - swap: troca duas caixas entre ondas, considerando em cada onda só as
+      swap_candidates caixas cuja saída mais reduz a área.
+    Cada movimento só considera as 2 * neighbor_radius ondas de corredor médio mais
+    próximo da caixa (ou da onda, no merge), via WaveNeighborhood.
+    Os movimentos são avaliados pela variação incremental de área total + WAVE_PENALTY
+    por onda, e ondas esvaziadas são descartadas. Com deadline (time.time()), o prazo é
+    conferido entre os movimentos e a busca para assim que ele vence.
+    """
+    by_class = defaultdict(list)
+    masks = {}
+    for wave in waves:
+        by_class[wave.wave_class].append(wave)
+        for entry in wave.boxes:
+            masks[entry] = pair_masks(pairs[entry])
+    moves = (
+        lambda class_waves, near: merge_waves_pass(class_waves, wave_capacity, near),
+        lambda class_waves, near: relocate_pass(class_waves, pieces, pairs, masks, wave_capacity, near),
+        lambda class_waves, near: swap_pass(class_waves, pieces, pairs, wave_capacity, swap_candidates, near),
+    )
+
+    def expired():
+        return deadline is not None and time.time() >= deadline
+
+    for _ in range(max_passes):
+        improved = False
+        for class_waves in by_class.values():
+            for move in moves:
+                if expired():
+                    break
+                class_waves[:] = [w for w in class_waves if w.boxes]
+                improved = move(class_waves, WaveNeighborhood(class_waves, neighbor_radius)) or improved
+            class_waves[:] = [w for w in class_waves if w.boxes]
+        if not improved or expired():
+            break
+    return [w for w in waves if w.boxes]
+
+def grasp_group_box_indexes(indexes, classes, pieces, pairs, iterations=50, alpha=0.3, wave_capacity=6000,
+                            time_limit=None, max_stall=None, local_search=True, cluster_width=8, cluster_radius=1, rng=None):
+    """
+    Núcleo do GRASP sobre índices inteiros de caixas: classes, pieces e pairs são
+    sequências indexadas pelo índice da caixa. Cada construção é seguida da busca
+    local sobre as ondas (improve_waves_local_search), se local_search for verdadeiro.
+    Com cluster_width (None desativa), as caixas são inseridas cluster a cluster (corridor_affinity_clusters)
+    e cada caixa considera primeiro as ondas cujo corredor médio cai em um cluster a até
+    cluster_radius do seu (todas as ondas viáveis, se nenhuma estiver perto). Ondas
+    só com caixas sem corredores contam como cluster 0.
+    Retorna (custo, ondas) da melhor iteração, com os índices das caixas em Wave.boxes.
+    time_limit e max_stall encerram a busca antes de completar as iterações (sempre
+    após pelo menos uma). rng é o gerador (random.Random) das ordens e das escolhas na
+    lista restrita; sem ele, usa o módulo random global.
+    """
+    rng = random if rng is None else rng
+    deadline = None if time_limit is None else time.time() + time_limit
+    clusters = None
+    if cluster_width is not None:
+        clusters = dict(zip(indexes, corridor_affinity_clusters([pairs[idx] for idx in indexes], cluster_width)))
+    masks = {idx: pair_masks(pairs[idx]) for idx in indexes}
     best_solution = None
     best_cost = float('inf')
+    stall = 0
     for it in range(iterations):
-        boxes_iter = copy.deepcopy(aggregated_boxes)
-        random.shuffle(boxes_iter)
+        order = list(indexes)
+        rng.shuffle(order)
+        if clusters is not None:
+            order = affinity_order(order, clusters)
+        next_min_pieces = remaining_min_pieces(order, classes, pieces)
         waves = []
-        for box in boxes_iter:
-            feasible_waves = [w for w in waves if w.wave_class == box["classe_onda"] and (w.total_pieces + box["pieces"]) <= wave_capacity]
+        open_waves = OpenWaveIndex(wave_capacity)
+        for pos, idx in enumerate(order):
+            feasible_waves = open_waves.feasible(classes[idx], pieces[idx])
+            if clusters is not None and feasible_waves:
+                # Só as ondas próximas do cluster da caixa; as demais apenas se não houver nenhuma
+                near_waves = [w for w in feasible_waves
+                              if abs(max(wave_midpoint(w), 0) // cluster_width - clusters[idx]) <= cluster_radius]
+                feasible_waves = near_waves or feasible_waves
             if feasible_waves:
                 candidate_costs = []
                 for w in feasible_waves:
-                    current_area = w.area()
-                    new_area = area_side(w.corridors + box["corridors"])
-                    incremental_cost = new_area - current_area
+                    incremental_cost = w.incremental_area_masks(*masks[idx])
                     candidate_costs.append((incremental_cost, w))
                 min_cost = min(cost for cost, _ in candidate_costs)
                 max_cost = max(cost for cost, _ in candidate_costs)
                 threshold = min_cost + alpha * (max_cost - min_cost)
                 rcl = [w for cost, w in candidate_costs if cost <= threshold]
-                chosen_wave = random.choice(rcl)
-                chosen_wave.add_box(box)
+                chosen_wave = rng.choice(rcl)
+                open_waves.remove(chosen_wave)
+                chosen_wave.add_entry(idx, pieces[idx], pairs[idx])
+                open_waves.add(chosen_wave)
             else:
-                new_wave = Wave(box["classe_onda"])
-                new_wave.add_box(box)
+                new_wave = Wave(classes[idx])
+                new_wave.add_entry(idx, pieces[idx], pairs[idx])
                 waves.append(new_wave)
-        total_area = sum(w.area() for w in waves)
-        cost = total_area + len(waves) * 10
+                open_waves.add(new_wave)
+            open_waves.retire(classes[idx], next_min_pieces[pos])
+        if local_search:
+            waves = improve_waves_local_search(waves, pieces, pairs, wave_capacity, deadline=deadline)
+        cost = wave_solution_cost(waves)
         if cost < best_cost:
             best_cost = cost
-            best_solution = copy.deepcopy(waves)
-    return best_solution
+            best_solution = waves
+            stall = 0
+        else:
+            stall += 1
+        if max_stall is not None and stall >= max_stall:
+            break
+        if deadline is not None and time.time() >= deadline:
+            break
+    return best_cost, best_solution
+
+def build_waves(index_waves, aggregated_boxes, wave_class=None):
+    # Converte ondas de índices em ondas com as caixas agregadas
+    waves = []
+    for index_wave in index_waves:
+        wave = Wave(index_wave.wave_class if wave_class is None else wave_class)
+        for idx in index_wave.boxes:
+            wave.add_box(aggregated_boxes[idx])
+        waves.append(wave)
+    return waves
+
+def grasp_group_boxes_into_waves(aggregated_boxes, iterations=50, alpha=0.3, wave_capacity=6000, time_limit=None, max_stall=None,
+                                 local_search=True, cluster_width=8, rng=None):
+    classes = [box["classe_onda"] for box in aggregated_boxes]
+    pieces = [box["pieces"] for box in aggregated_boxes]
+    pairs = [box_pairs(box) for box in aggregated_boxes]
+    _, index_waves = grasp_group_box_indexes(range(len(aggregated_boxes)), classes, pieces, pairs,
+                                             iterations=iterations, alpha=alpha, wave_capacity=wave_capacity,
+                                             time_limit=time_limit, max_stall=max_stall, local_search=local_search,
+                                             cluster_width=cluster_width, rng=rng)
+    if index_waves is None:
+        return None
+    return build_waves(index_waves, aggregated_boxes)
 
 # =============================================================================
 # Função para validar a solução final de ondas (cada caixa deve aparecer em uma única onda)
@@ -420,9 +1434,9 @@ def validate_final_waves(aggregated_boxes, waves, wave_capacity):
 # =============================================================================
 # Função para salvar a solução final de ondas em CSV
 # =============================================================================
-def save_wave_solution(waves, output_csv):
+def save_wave_solution(waves, output_csv, start_wave=1, append=False):
     rows = []
-    wave_counter = 1
+    wave_counter = start_wave
     for wave in waves:
         wave_id = f"Onda_{wave_counter}"
         for box in wave.boxes:
@@ -436,26 +1450,468 @@ def save_wave_solution(waves, output_csv):
             })
         wave_counter += 1
     df = pd.DataFrame(rows)
-    df.to_csv(output_csv, index=False, encoding="utf-8")
+    if append:
+        df.to_csv(output_csv, mode="a", header=False, index=False, encoding="utf-8")
+    else:
+        df.to_csv(output_csv, index=False, encoding="utf-8")
     print(f"CSV final de ondas salvo em: {output_csv}")
 
+# =============================================================================
+# Saída normalizada em tabelas (onda -> caixa e caixa -> SKU -> posição)
+# =============================================================================
+OUTPUT_TABLES = {
+    "ondas": ["wave", "classe_onda", "caixa_id", "pieces"],
+    "alocacoes": ["caixa_id", "sku", "required", "andar", "corredor", "qty"],
+}
+
+class WaveTableWriter:
+    """
+    Grava as ondas em duas tabelas normalizadas, sem dicionários serializados com str():
+    - ondas.<fmt>: uma linha por caixa, com a onda e a classe;
+    - alocacoes.<fmt>: uma linha por (caixa, SKU, posição), com a quantidade alocada.
+    fmt é "csv" ou "parquet" (requer pyarrow). Cada write monta só as colunas do lote
+    de ondas recebido e as grava em seguida: em CSV as linhas vão para o fim do arquivo,
+    em Parquet cada lote vira um row group. As ondas são numeradas dentro da classe
+    (CLASSE-Onda_1, ...), com a numeração continuando entre lotes da mesma classe; assim
+    os ids não dependem da ordem em que as classes são gravadas.
+    """
+    def __init__(self, output_dir, fmt="csv"):
+        if fmt not in ("csv", "parquet"):
+            raise Exception(f"Formato de saída desconhecido: {fmt}")
+        self.fmt = fmt
+        self.next_wave = defaultdict(lambda: 1)
+        self.paths = {name: os.path.join(output_dir, f"{name}.{fmt}") for name in OUTPUT_TABLES}
+        self.files = {}
+        self.writers = {}
+        if fmt == "parquet":
+            try:
+                from pyarrow import parquet, table
+            except ImportError:
+                raise Exception("Saída em Parquet requer o pacote pyarrow")
+            self.arrow_table = table
+            self.parquet = parquet
+        os.makedirs(output_dir, exist_ok=True)
+        if fmt == "csv":
+            for name, path in self.paths.items():
+                self.files[name] = open(path, "w", newline="", encoding="utf-8")
+                self.writers[name] = csv.writer(self.files[name], lineterminator="\n")
+                self.writers[name].writerow(OUTPUT_TABLES[name])
+
+    def write(self, waves):
+        columns = {name: {col: [] for col in cols} for name, cols in OUTPUT_TABLES.items()}
+        ondas, alocacoes = columns["ondas"], columns["alocacoes"]
+        for wave in waves:
+            wave_id = f"{wave.wave_class}-Onda_{self.next_wave[wave.wave_class]}"
+            self.next_wave[wave.wave_class] += 1
+            for box in wave.boxes:
+                ondas["wave"].append(wave_id)
+                ondas["classe_onda"].append(wave.wave_class)
+                ondas["caixa_id"].append(box["caixa_id"])
+                ondas["pieces"].append(box["pieces"])
+                for sku, data in box["items"].items():
+                    for andar, corredor, qty in data["allocations"]:
+                        alocacoes["caixa_id"].append(box["caixa_id"])
+                        alocacoes["sku"].append(sku)
+                        alocacoes["required"].append(data["required"])
+                        alocacoes["andar"].append(andar)
+                        alocacoes["corredor"].append(corredor)
+                        alocacoes["qty"].append(qty)
+        for name, table in columns.items():
+            if not table[OUTPUT_TABLES[name][0]]:
+                continue
+            if self.fmt == "csv":
+                self.writers[name].writerows(zip(*table.values()))
+            else:
+                batch = self.arrow_table(table)
+                if name not in self.writers:
+                    self.writers[name] = self.parquet.ParquetWriter(self.paths[name], batch.schema)
+                self.writers[name].write_table(batch)
+
+    def close(self):
+        for writer in self.writers.values():
+            if self.fmt == "parquet":
+                writer.close()
+        for f in self.files.values():
+            f.close()
+        self.writers = {}
+        self.files = {}
+
+def save_wave_tables(waves, output_dir, fmt="csv"):
+    # Um write por classe: só as colunas de uma classe ficam em memória de cada vez
+    writer = WaveTableWriter(output_dir, fmt)
+    try:
+        for _, class_waves in itertools.groupby(waves, key=lambda wave: wave.wave_class):
+            writer.write(list(class_waves))
+    finally:
+        writer.close()
+    print(f"Tabelas de ondas salvas em: {', '.join(writer.paths.values())}")
+
+# =============================================================================
+# Checkpoints binários entre etapas do pipeline
+# =============================================================================
+CHECKPOINT_DIR = "checkpoints"
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def checkpoint_key(*parts):
+    # Hash dos arquivos de entrada (via file_digest) e dos parâmetros de cada etapa
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def id_array(ids):
+    # CAIXA_ID numérico vira int64; ids textuais são gravados como strings Unicode
+    if all(isinstance(i, (int, np.integer)) for i in ids):
+        return np.array(ids, dtype=np.int64)
+    return np.array([str(i) for i in ids])
+
+def save_arrays_checkpoint(directory, arrays, meta):
+    """
+    Grava cada array em um .npy (carregável com memory-map) e os metadados em
+    meta.json. A escrita é feita em um diretório temporário e renomeada no fim.
+    """
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+def load_arrays_checkpoint(directory):
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None, None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+    return arrays, meta
+
+def save_solution_checkpoint(directory, solution, seed=None):
+    """
+    Solução a nível de caixa em colunas: uma linha por (caixa, SKU) com códigos de
+    classe e SKU, e as alocações em formato CSR (offsets + andar/corredor/quantidade).
+    A semente mestre da execução que gerou a solução fica nos metadados.
+    """
+    classes, skus = {}, {}
+    offsets, andares, corredores, quantidades = [0], [], [], []
+    for entry in solution:
+        for andar, corredor, qty in entry["allocations"]:
+            andares.append(andar)
+            corredores.append(corredor)
+            quantidades.append(qty)
+        offsets.append(len(quantidades))
+    arrays = {
+        "caixa_id": id_array([entry["caixa_id"] for entry in solution]),
+        "class_code": np.array([classes.setdefault(entry["classe_onda"], len(classes)) for entry in solution], dtype=np.int32),
+        "sku_code": np.array([skus.setdefault(entry["sku"], len(skus)) for entry in solution], dtype=np.int32),
+        "required": np.array([entry["required"] for entry in solution], dtype=np.int64),
+        "alloc_offsets": np.array(offsets, dtype=np.int64),
+        "alloc_andar": np.array(andares, dtype=np.int32),
+        "alloc_corredor": np.array(corredores, dtype=np.int32),
+        "alloc_qty": np.array(quantidades, dtype=np.int64),
+    }
+    save_arrays_checkpoint(directory, arrays, {"arrays": list(arrays), "classes": list(classes), "skus": list(skus), "seed": seed})
+
+def checkpoint_seed(directory):
+    # Semente gravada nos metadados do checkpoint (None se não houver checkpoint ou semente)
+    _, meta = load_arrays_checkpoint(directory)
+    return None if meta is None else meta.get("seed")
+
+def load_solution_checkpoint(directory):
+    arrays, meta = load_arrays_checkpoint(directory)
+    if arrays is None:
+        return None
+    offsets = arrays["alloc_offsets"].tolist()
+    allocations = list(zip(arrays["alloc_andar"].tolist(), arrays["alloc_corredor"].tolist(), arrays["alloc_qty"].tolist()))
+    solution = []
+    for i, (caixa_id, class_code, sku_code, required) in enumerate(zip(
+            arrays["caixa_id"].tolist(), arrays["class_code"].tolist(), arrays["sku_code"].tolist(), arrays["required"].tolist())):
+        solution.append({
+            "caixa_id": caixa_id,
+            "classe_onda": meta["classes"][class_code],
+            "sku": meta["skus"][sku_code],
+            "required": required,
+            "allocations": allocations[offsets[i]:offsets[i + 1]]
+        })
+    return solution
+
+def save_wave_checkpoint(directory, waves):
+    """
+    Ondas em CSR: offsets por onda sobre a lista de caixa_id, mais o código da classe.
+    As caixas agregadas não são gravadas: são recalculadas de forma determinística com
+    aggregate_boxes a partir do checkpoint da solução.
+    """
+    classes = {}
+    offsets, box_ids = [0], []
+    for wave in waves:
+        box_ids.extend(box["caixa_id"] for box in wave.boxes)
+        offsets.append(len(box_ids))
+    arrays = {
+        "wave_class": np.array([classes.setdefault(wave.wave_class, len(classes)) for wave in waves], dtype=np.int32),
+        "wave_offsets": np.array(offsets, dtype=np.int64),
+        "caixa_id": id_array(box_ids),
+    }
+    save_arrays_checkpoint(directory, arrays, {"arrays": list(arrays), "classes": list(classes)})
+
+def load_wave_checkpoint(directory, aggregated_boxes):
+    arrays, meta = load_arrays_checkpoint(directory)
+    if arrays is None:
+        return None
+    boxes_by_id = {box["caixa_id"]: box for box in aggregated_boxes}
+    offsets = arrays["wave_offsets"].tolist()
+    box_ids = arrays["caixa_id"].tolist()
+    waves = []
+    for i, class_code in enumerate(arrays["wave_class"].tolist()):
+        wave = Wave(meta["classes"][class_code])
+        for cid in box_ids[offsets[i]:offsets[i + 1]]:
+            wave.add_box(boxes_by_id[cid])
+        waves.append(wave)
+    return waves
+
+# =============================================================================
+# Representação colunar das caixas agregadas em memória compartilhada
+# =============================================================================
+class SharedBoxArrays:
+    """
+    Caixas agregadas codificadas em arrays NumPy (códigos de classe, peças e
+    corredores em formato CSR: offsets + andares + corredores), todos em um único
+    bloco de multiprocessing.shared_memory. Os workers se conectam pelo handle, sem
+    cópia, e o GRASP trabalha com os índices inteiros das caixas; os ids (CAIXA_ID,
+    de qualquer tipo) ficam só no processo principal.
+    """
+    FIELDS = (
+        ("class_codes", np.int32),
+        ("pieces", np.int64),
+        ("corridor_offsets", np.int64),
+        ("corridor_floors", np.int32),
+        ("corridor_numbers", np.int32),
+    )
+
+    def __init__(self, shm, layout, class_names):
+        self.shm = shm
+        self.layout = layout
+        self.class_names = class_names
+        self.arrays = {field: np.ndarray((length,), dtype=dtype, buffer=shm.buf, offset=offset)
+                       for field, dtype, offset, length in layout}
+
+    @classmethod
+    def create(cls, aggregated_boxes):
+        class_names = sorted({box["classe_onda"] for box in aggregated_boxes})
+        class_index = {name: code for code, name in enumerate(class_names)}
+        offsets = [0]
+        floors, numbers = [], []
+        for box in aggregated_boxes:
+            for fl, corr, _ in box["corridors"]:
+                floors.append(fl)
+                numbers.append(corr)
+            offsets.append(len(floors))
+        columns = {
+            "class_codes": [class_index[box["classe_onda"]] for box in aggregated_boxes],
+            "pieces": [box["pieces"] for box in aggregated_boxes],
+            "corridor_offsets": offsets,
+            "corridor_floors": floors,
+            "corridor_numbers": numbers,
+        }
+        layout, size = [], 0
+        for field, dtype in cls.FIELDS:
+            dtype = np.dtype(dtype)
+            size = -(-size // 8) * 8  # alinhamento de 8 bytes
+            layout.append((field, dtype.str, size, len(columns[field])))
+            size += dtype.itemsize * len(columns[field])
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            arrays = cls(shm, layout, class_names)
+            for field, _ in cls.FIELDS:
+                arrays.arrays[field][:] = columns[field]
+        except Exception:
+            # Um valor fora do tipo da coluna não pode deixar o bloco órfão
+            shm.close()
+            shm.unlink()
+            raise
+        return arrays
+
+    @classmethod
+    def attach(cls, handle):
+        name, layout, class_names = handle
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, layout, class_names)
+
+    def handle(self):
+        return (self.shm.name, self.layout, self.class_names)
+
+    def class_view(self, class_code):
+        """
+        Índices globais, peças e pares (andar, corredor) das caixas de uma classe,
+        na ordem original das caixas agregadas.
+        """
+        indexes = np.flatnonzero(self.arrays["class_codes"] == class_code)
+        offsets = self.arrays["corridor_offsets"]
+        floors = self.arrays["corridor_floors"]
+        numbers = self.arrays["corridor_numbers"]
+        pieces = self.arrays["pieces"][indexes].tolist()
+        pairs = []
+        for idx in indexes:
+            start, end = offsets[idx], offsets[idx + 1]
+            pairs.append(list(zip(floors[start:end].tolist(), numbers[start:end].tolist())))
+        return indexes.tolist(), pieces, pairs
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+# Conexões e visões por classe já abertas em cada processo worker
+_ATTACHED_ARRAYS = {}
+_CLASS_VIEWS = {}
+
+def attached_class_view(handle, class_code):
+    name = handle[0]
+    if name not in _ATTACHED_ARRAYS:
+        # Um pool de longa duração (modo serviço) recebe um bloco novo a cada pedido:
+        # as conexões dos pedidos anteriores são fechadas antes de abrir a nova
+        for old_name in list(_ATTACHED_ARRAYS):
+            _ATTACHED_ARRAYS.pop(old_name).close()
+        _CLASS_VIEWS.clear()
+        _ATTACHED_ARRAYS[name] = SharedBoxArrays.attach(handle)
+    if (name, class_code) not in _CLASS_VIEWS:
+        _CLASS_VIEWS[(name, class_code)] = _ATTACHED_ARRAYS[name].class_view(class_code)
+    return _CLASS_VIEWS[(name, class_code)]
+
 # =============================================================================
 # Função para paralelizar o agrupamento de caixas em ondas por classe
 # =============================================================================
-def process_wave_class(class_wave, aggregated_boxes, iterations, alpha, wave_capacity):
-    boxes_class = [box for box in aggregated_boxes if box["classe_onda"] == class_wave]
-    waves = grasp_group_boxes_into_waves(boxes_class, iterations=iterations, alpha=alpha, wave_capacity=wave_capacity)
-    return class_wave, waves
+def derive_seed(master_seed, *keys):
+    # Semente derivada de forma determinística a partir da semente mestre e das chaves
+    return random.Random(":".join(str(k) for k in (master_seed,) + keys)).getrandbits(64)
+
+def derive_rng(master_seed, *keys):
+    # Gerador próprio de uma etapa (ou classe, ou bloco), independente dos demais
+    return random.Random(derive_seed(master_seed, *keys))
 
-def parallel_grasp_grouping(aggregated_boxes, iterations=50, alpha=0.3, wave_capacity=6000, max_workers=4):
-    classes = list({box["classe_onda"] for box in aggregated_boxes})
-    results = {}
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_wave_class, cls, aggregated_boxes, iterations, alpha, wave_capacity): cls for cls in classes}
-        for future in as_completed(futures):
-            cls, waves = future.result()
-            results[cls] = waves
-    return results
+def new_master_seed():
+    # Semente mestre de uma execução sem semente informada; deve ser registrada para reprodução
+    return random.SystemRandom().getrandbits(63)
+
+def split_iterations(iterations, num_chunks):
+    num_chunks = max(1, min(num_chunks, iterations))
+    base, extra = divmod(iterations, num_chunks)
+    return [base + (1 if k < extra else 0) for k in range(num_chunks)]
+
+def plan_grasp_chunks(class_sizes, iterations, max_workers, seed, time_limit=None, small_first=False):
+    """
+    Divide as iterações de cada classe em blocos independentes com semente própria.
+    O nº de blocos de cada classe é proporcional ao seu trabalho (caixas x iterações),
+    e os blocos são ordenados do maior para o menor: os workers ociosos puxam o próximo
+    bloco da fila do executor, de modo que as classes pequenas preenchem os intervalos
+    deixados pelas grandes. Com time_limit, cada bloco recebe uma fatia do tempo total
+    dos workers proporcional ao seu trabalho (limitada ao próprio time_limit).
+    Com small_first, os blocos saem por classe, da menor para a maior: as classes
+    pequenas terminam primeiro, como convém à entrega em fluxo.
+    """
+    total_work = sum(size * iterations for size in class_sizes.values())
+    target_work = max(1, total_work / (max_workers * 4))
+    chunks = []
+    for cls in sorted(class_sizes):
+        work = class_sizes[cls] * iterations
+        num_chunks = -(-work // target_work) if work else 1
+        for k, chunk_iterations in enumerate(split_iterations(iterations, int(num_chunks))):
+            chunks.append({
+                "classe_onda": cls,
+                "chunk": k,
+                "iterations": chunk_iterations,
+                "seed": derive_seed(seed, cls, k),
+                "work": class_sizes[cls] * chunk_iterations
+            })
+    for c in chunks:
+        c["time_limit"] = None if time_limit is None else min(time_limit, time_limit * max_workers * c["work"] / max(total_work, 1))
+    if small_first:
+        chunks.sort(key=lambda c: (class_sizes[c["classe_onda"]], c["classe_onda"], c["chunk"]))
+    else:
+        chunks.sort(key=lambda c: (-c["work"], c["classe_onda"], c["chunk"]))
+    return chunks
+
+def process_wave_chunk(handle, class_code, chunk, iterations, alpha, wave_capacity, seed,
+                       time_limit=None, deadline=None, max_stall=None, local_search=True, cluster_width=8):
+    indexes, pieces, pairs = attached_class_view(handle, class_code)
+    classes = [class_code] * len(indexes)
+    if deadline is not None:
+        # A fatia do bloco nunca ultrapassa o prazo global da etapa
+        remaining = max(0.0, deadline - time.time())
+        time_limit = remaining if time_limit is None else min(time_limit, remaining)
+    cost, index_waves = grasp_group_box_indexes(range(len(indexes)), classes, pieces, pairs,
+                                                iterations=iterations, alpha=alpha, wave_capacity=wave_capacity,
+                                                time_limit=time_limit, max_stall=max_stall, local_search=local_search,
+                                                cluster_width=cluster_width, rng=random.Random(seed))
+    # Devolve apenas os índices globais das caixas de cada onda
+    return class_code, chunk, cost, [[indexes[local] for local in wave.boxes] for wave in index_waves]
+
+def stream_grasp_grouping(aggregated_boxes, iterations=50, alpha=0.3, wave_capacity=6000, max_workers=4, seed=None,
+                          time_limit=None, max_stall=None, local_search=True, cluster_width=8, executor=None,
+                          small_first=False, metrics=NO_METRICS):
+    """
+    Gera (classe, ondas) de cada classe assim que o último bloco dela termina
+    (as_completed), sem esperar pelas demais classes. Com executor, usa um pool já
+    aberto (modo serviço) e não o encerra; sem ele, cria um pool com max_workers.
+    small_first submete os blocos das classes menores antes (plan_grasp_chunks), para
+    que saiam primeiro; sem ele, a ordem é a de menor tempo total.
+    Sem seed, a semente sorteada é registrada no evento "seed" de metrics.
+    """
+    deadline = None if time_limit is None else time.time() + time_limit
+    if seed is None:
+        seed = new_master_seed()
+        metrics.emit("seed", stage="grasp", seed=seed)
+    if not aggregated_boxes or iterations <= 0:
+        return
+    arrays = SharedBoxArrays.create(aggregated_boxes)
+    try:
+        class_codes = {name: code for code, name in enumerate(arrays.class_names)}
+        class_sizes = defaultdict(int)
+        for box in aggregated_boxes:
+            class_sizes[box["classe_onda"]] += 1
+        chunks = plan_grasp_chunks(class_sizes, iterations, max_workers, seed, time_limit, small_first)
+        pending = defaultdict(int)
+        for c in chunks:
+            pending[class_codes[c["classe_onda"]]] += 1
+        best = {}
+        with contextlib.nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(process_wave_chunk, arrays.handle(), class_codes[c["classe_onda"]], c["chunk"],
+                                   c["iterations"], alpha, wave_capacity, c["seed"],
+                                   c["time_limit"], deadline, max_stall, local_search, cluster_width) for c in chunks]
+            for future in as_completed(futures):
+                code, chunk, cost, index_waves = future.result()
+                # Redução pelo melhor custo; empates resolvidos pelo índice do bloco
+                if code not in best or (cost, chunk) < best[code][:2]:
+                    best[code] = (cost, chunk, index_waves)
+                pending[code] -= 1
+                if pending[code] == 0:
+                    cls = arrays.class_names[code]
+                    waves = []
+                    for members in best.pop(code)[2]:
+                        wave = Wave(cls)
+                        for idx in members:
+                            wave.add_box(aggregated_boxes[idx])
+                        waves.append(wave)
+                    yield cls, waves
+    finally:
+        arrays.close()
+        arrays.unlink()
+
+def parallel_grasp_grouping(aggregated_boxes, iterations=50, alpha=0.3, wave_capacity=6000, max_workers=4, seed=None,
+                            time_limit=None, max_stall=None, local_search=True, cluster_width=8, metrics=NO_METRICS):
+    # Espera todas as classes; o resultado vem ordenado por classe, independente da
+    # ordem de conclusão dos blocos
+    results = stream_grasp_grouping(aggregated_boxes, iterations=iterations, alpha=alpha, wave_capacity=wave_capacity,
+                                    max_workers=max_workers, seed=seed, time_limit=time_limit, max_stall=max_stall,
+                                    local_search=local_search, cluster_width=cluster_width, metrics=metrics)
+    return dict(sorted(results, key=lambda item: item[0]))
 
 # =============================================================================
 # Função para salvar logs de validação em arquivo e resumir no terminal
@@ -474,22 +1930,344 @@ def summarize_errors(errors):
     for prefix, count in summary.items():
         print(f"{prefix}: {count} ocorrências")
 
+# =============================================================================
+# Replanejamento incremental: novas caixas e variações de estoque
+# =============================================================================
+def apply_stock_deltas(stock, stock_deltas):
+    """
+    Aplica variações (sku, andar, corredor, delta) ao estoque sem alterar o original.
+    Posições novas entram na lista do SKU, que é reordenada por quantidade.
+    Retorna (novo estoque, SKUs alterados).
+    """
+    new_stock = defaultdict(list, {sku: list(entries) for sku, entries in stock.items()})
+    changed = set()
+    for sku, andar, corredor, delta in stock_deltas:
+        entries = new_stock[sku]
+        for i, (fl, corr, qty) in enumerate(entries):
+            if (fl, corr) == (andar, corredor):
+                entries[i] = (fl, corr, max(0, qty + delta))
+                break
+        else:
+            entries.append((andar, corredor, max(0, delta)))
+        changed.add(sku)
+    for sku in changed:
+        new_stock[sku].sort(key=lambda x: -x[2])
+    return new_stock, changed
+
+def insert_boxes_into_waves(waves, boxes, alpha=0.0, wave_capacity=6000, rng=None):
+    """
+    Insere caixas agregadas nas ondas existentes da mesma classe, pelo menor acréscimo
+    de área (com alpha > 0, sorteando na lista restrita como no GRASP). Caixas sem onda
+    viável abrem uma nova onda.
+    """
+    rng = random if rng is None else rng
+    open_waves = OpenWaveIndex(wave_capacity)
+    for wave in waves:
+        open_waves.add(wave)
+    for box in boxes:
+        feasible_waves = open_waves.feasible(box["classe_onda"], box["pieces"])
+        if feasible_waves:
+            candidate_costs = [(w.incremental_area(box), w) for w in feasible_waves]
+            min_cost = min(cost for cost, _ in candidate_costs)
+            max_cost = max(cost for cost, _ in candidate_costs)
+            threshold = min_cost + alpha * (max_cost - min_cost)
+            chosen_wave = rng.choice([w for cost, w in candidate_costs if cost <= threshold])
+            open_waves.remove(chosen_wave)
+            chosen_wave.add_box(box)
+            open_waves.add(chosen_wave)
+        else:
+            new_wave = Wave(box["classe_onda"])
+            new_wave.add_box(box)
+            waves.append(new_wave)
+            open_waves.add(new_wave)
+    return waves
+
+def replan_incremental(solution, waves, stock, new_boxes=(), stock_deltas=(), alpha=0.0, wave_capacity=6000, rng=None):
+    """
+    Atualiza uma solução já planejada sem refazer o pipeline:
+    1. aplica as variações de estoque e realoca apenas as linhas dos SKUs alterados que
+       usam posições agora acima do disponível;
+    2. aloca as novas caixas contra o estoque ainda livre;
+    3. roda a busca local só nas linhas dos SKUs alterados e das novas caixas;
+    4. retira das ondas as caixas cujas alocações mudaram e as reinsere, junto com as
+       novas, nas ondas da sua classe; ondas não tocadas são mantidas como estão.
+    Os argumentos não são modificados. Retorna (solução, ondas, estoque). rng só é
+    usado para sortear ondas quando alpha > 0.
+    """
+    new_stock, changed_skus = apply_stock_deltas(stock, stock_deltas)
+    solution = [dict(entry) for entry in solution]
+    state = SolutionState(solution, new_stock)
+    ledger = state.ledger
+    rows_by_sku = defaultdict(list)
+    for i, entry in enumerate(solution):
+        rows_by_sku[entry["sku"]].append(i)
+    affected_rows = []
+    for sku in changed_skus:
+        for i in rows_by_sku.get(sku, []):
+            affected_rows.append(i)
+            entry = solution[i]
+            if ledger.overflow.get(sku, 0) == 0:
+                continue
+            if any(ledger.is_position_over(sku, (fl, corr)) for fl, corr, _ in entry["allocations"]):
+                effective_stock = ledger.effective_stock(sku, entry["allocations"])
+                state.assign(i, allocate_sku_greedy(sku, entry["required"], {sku: effective_stock}))
+        if ledger.overflow.get(sku, 0):
+            raise Exception(f"Estoque insuficiente para {sku} após as variações de estoque")
+    new_box_ids = set()
+    for box in new_boxes:
+        new_box_ids.add(box["caixa_id"])
+        for sku, required in box["items"].items():
+            allocation = allocate_sku_greedy(sku, required, {sku: ledger.effective_stock(sku, [])})
+            affected_rows.append(len(solution))
+            state.append({
+                "caixa_id": box["caixa_id"],
+                "classe_onda": box["classe_onda"],
+                "sku": sku,
+                "required": required,
+                "allocations": allocation
+            })
+    local_search_solution(solution, new_stock, state, indices=affected_rows)
+    changed_box_ids = new_box_ids | {solution[i]["caixa_id"] for i in state.undo_log}
+    new_waves = []
+    for wave in waves:
+        if any(box["caixa_id"] in changed_box_ids for box in wave.boxes):
+            rebuilt = Wave(wave.wave_class)
+            for box in wave.boxes:
+                if box["caixa_id"] not in changed_box_ids:
+                    rebuilt.add_box(box)
+            if rebuilt.boxes:
+                new_waves.append(rebuilt)
+        else:
+            # Cópia: a reinserção pode acrescentar caixas às ondas não tocadas
+            new_waves.append(wave.copy())
+    changed_boxes = aggregate_boxes([entry for entry in solution if entry["caixa_id"] in changed_box_ids])
+    insert_boxes_into_waves(new_waves, changed_boxes, alpha=alpha, wave_capacity=wave_capacity, rng=rng)
+    return solution, new_waves, new_stock
+
+# =============================================================================
+# Orçamento de tempo (modo anytime) dividido entre ILS e GRASP
+# =============================================================================
+def split_time_budget(total_seconds, ils_share=0.4):
+    ils_budget = total_seconds * ils_share
+    return ils_budget, total_seconds - ils_budget
+
+def positive_seconds(value):
+    # Tipo do argparse para --time-budget: 0 ou negativo é erro, não "sem orçamento"
+    seconds = float(value)
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError(f"o orçamento deve ser positivo: {value}")
+    return seconds
+
+# =============================================================================
+# Pipeline em fluxo: alocação, ILS e ondas uma classe por vez
+# =============================================================================
+def subtract_allocations(stock, solution):
+    """
+    Retorna uma cópia do estoque descontando as alocações da solução.
+    """
+    usage = defaultdict(lambda: defaultdict(int))
+    for entry in solution:
+        for andar, corredor, qty in entry["allocations"]:
+            usage[entry["sku"]][(andar, corredor)] += qty
+    remaining = defaultdict(list)
+    for sku, entries in stock.items():
+        used = usage.get(sku, {})
+        for andar, corredor, qty in entries:
+            taken = min(qty, used.get((andar, corredor), 0))
+            if taken:
+                used[(andar, corredor)] -= taken
+            remaining[sku].append((andar, corredor, qty - taken))
+    return remaining
+
+def plan_classes_streaming(class_paths, stock, ils_iter=1, perturbation_strength=0.2, iterations=2, alpha=0.3, wave_capacity=6000,
+                           seed=None, metrics=NO_METRICS):
+    """
+    Processa as classes em sequência, carregando do disco apenas as caixas da classe
+    corrente. O estoque restante de uma classe é o estoque inicial da seguinte.
+    O ILS e o GRASP de cada classe usam geradores derivados de seed e da classe; sem
+    seed, a semente sorteada é registrada no evento "seed" de metrics.
+    Gera (classe, caixas, solução refinada, ondas, estoque da classe).
+    """
+    if seed is None:
+        seed = new_master_seed()
+        metrics.emit("seed", stage="stream", seed=seed)
+    remaining = stock
+    for cls in sorted(class_paths):
+        boxes = load_class_boxes(class_paths[cls])
+        stock_errors = validate_overall_stock(boxes, remaining)
+        if stock_errors:
+            raise Exception(f"Estoque insuficiente para a classe {cls}: {stock_errors[0]}")
+        initial_solution, _ = allocate_boxes_batch(boxes, remaining)
+        refined_solution = ils_refine_solution(initial_solution, remaining, max_iter=ils_iter, perturbation_strength=perturbation_strength,
+                                               rng=derive_rng(seed, "ils", cls))
+        aggregated_boxes = aggregate_boxes(refined_solution)
+        waves = grasp_group_boxes_into_waves(aggregated_boxes, iterations=iterations, alpha=alpha, wave_capacity=wave_capacity,
+                                             rng=derive_rng(seed, "grasp", cls))
+        yield cls, boxes, refined_solution, waves, remaining
+        remaining = subtract_allocations(remaining, refined_solution)
+
+def run_streaming_pipeline(caixas_path, estoque_path, spill_dir, output_path, chunksize=200000, output_format="legado", **params):
+    """
+    output_format "legado" grava o CSV único de save_wave_solution em output_path;
+    "csv" ou "parquet" gravam as tabelas de WaveTableWriter no diretório output_path,
+    uma classe por vez. Com spill_dir None, os arquivos por classe vão para um
+    diretório temporário, apagado no fim (inclusive em caso de erro); um spill_dir
+    explícito é mantido.
+    """
+    stock = preprocess_stock(pd.read_csv(estoque_path, engine=CSV_ENGINE))
+    spill_context = tempfile.TemporaryDirectory(prefix="caixas_por_classe_") if spill_dir is None else contextlib.nullcontext(spill_dir)
+    with spill_context as spill_dir:
+        class_paths = spill_boxes_by_class(caixas_path, spill_dir, chunksize)
+        print(f"Classes despejadas em disco: {len(class_paths)}")
+        table_writer = None if output_format == "legado" else WaveTableWriter(output_path, output_format)
+        next_wave = 1
+        try:
+            for cls, boxes, refined_solution, waves, class_stock in plan_classes_streaming(class_paths, stock, **params):
+                is_valid, validation_errors = validate_solution(boxes, refined_solution, class_stock)
+                if not is_valid:
+                    print(f"Erros na validação da classe {cls} (resumo):")
+                    summarize_errors(validation_errors)
+                print(f"{cls}: {len(boxes)} caixas, custo {cost_solution(refined_solution)}, {len(waves)} ondas")
+                if table_writer is not None:
+                    table_writer.write(waves)
+                else:
+                    save_wave_solution(waves, output_path, start_wave=next_wave, append=next_wave > 1)
+                next_wave += len(waves)
+        finally:
+            if table_writer is not None:
+                table_writer.close()
+
+# =============================================================================
+# Modo serviço: pedidos e respostas em JSON lines, com pool de processos aquecido
+# =============================================================================
+def wave_payload(wave, number):
+    # Numeração por classe: o id da onda não depende da ordem em que as classes terminam
+    return {
+        "onda": f"{wave.wave_class}-Onda_{number}",
+        "classe_onda": wave.wave_class,
+        "caixas": [box["caixa_id"] for box in wave.boxes],
+        "pieces": wave.total_pieces,
+        "area": wave.area()
+    }
+
+def plan_request(request, executor, max_workers=4, metrics=NO_METRICS):
+    """
+    Executa um pedido de planejamento e gera as mensagens de resposta: uma "class"
+    por classe, assim que as ondas dela ficam prontas, e uma "done" com o resumo.
+    Campos do pedido: caixas e estoque (caminhos dos CSV) e, opcionais, ils_iter,
+    perturbation_strength, iterations, alpha, wave_capacity e seed. A semente usada
+    (sorteada, se o pedido não trouxer uma) volta na mensagem "done" e no evento
+    "seed" de metrics.
+    """
+    start = time.time()
+    seed = request.get("seed")
+    if seed is None:
+        seed = new_master_seed()
+        metrics.emit("seed", stage="request", seed=seed)
+    with metrics.stage("load"):
+        caixas_df, estoque_df = load_data(request["caixas"], request["estoque"])
+        boxes = preprocess_boxes(caixas_df)
+        stock = preprocess_stock(estoque_df)
+    stock_errors = validate_overall_stock(boxes, stock)
+    if stock_errors:
+        raise Exception(f"Estoque global insuficiente: {stock_errors[0]}")
+    with metrics.stage("greedy"):
+        initial_solution, _ = allocate_boxes_batch(boxes, stock)
+    with metrics.stage("ils"):
+        refined_solution = ils_refine_solution(initial_solution, stock, max_iter=request.get("ils_iter", 1),
+                                               perturbation_strength=request.get("perturbation_strength", 0.2),
+                                               metrics=metrics, rng=derive_rng(seed, "ils"))
+    aggregated_boxes = aggregate_boxes(refined_solution)
+    total_waves = 0
+    for cls, waves in stream_grasp_grouping(aggregated_boxes, iterations=request.get("iterations", 2),
+                                            alpha=request.get("alpha", 0.3), wave_capacity=request.get("wave_capacity", 6000),
+                                            max_workers=max_workers, seed=derive_seed(seed, "grasp"), executor=executor,
+                                            small_first=True, metrics=metrics):
+        yield {"event": "class", "classe_onda": cls, "cost": wave_solution_cost(waves),
+               "waves": [wave_payload(wave, k + 1) for k, wave in enumerate(waves)]}
+        total_waves += len(waves)
+    yield {"event": "done", "waves": total_waves, "box_area": cost_solution(refined_solution),
+           "seed": seed, "seconds": round(time.time() - start, 4)}
+
+def serve_json_lines(input_stream, output_stream, max_workers=4, metrics=NO_METRICS):
+    """
+    Serviço de longa duração: lê um pedido JSON por linha e escreve cada resposta
+    como uma linha JSON com o id do pedido. O pool de processos é criado uma vez e
+    reaproveitado por todos os pedidos. Um pedido com erro gera uma mensagem "error"
+    e o serviço continua. As mensagens de progresso das etapas vão para stderr; os
+    tempos por etapa e um evento "request" por pedido vão para metrics.
+    """
+    def send(message):
+        output_stream.write(json.dumps(message, default=str) + "\n")
+        output_stream.flush()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, contextlib.redirect_stdout(sys.stderr):
+        for line in input_stream:
+            if not line.strip():
+                continue
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                for message in plan_request(request, executor, max_workers, metrics):
+                    send({"id": request_id, **message})
+                    if message["event"] == "done":
+                        metrics.emit("request", id=request_id, waves=message["waves"], seconds=message["seconds"])
+            except Exception as e:
+                metrics.emit("request", id=request_id, error=str(e))
+                send({"id": request_id, "event": "error", "message": str(e)})
+
 # =============================================================================
 # Execução completa com marcadores de tempo
 # =============================================================================
 if __name__ == "__main__":
     start_time = time.time()
     
+    parser = argparse.ArgumentParser(description="Alocação de SKUs (gulosa + ILS) e agrupamento de caixas em ondas (GRASP).")
+    parser.add_argument("--stream", action="store_true", help="lê as caixas em blocos e processa uma classe por vez")
+    parser.add_argument("--output-format", choices=["legado", "csv", "parquet"], default="legado",
+                        help="legado: CSV único com itens e corredores serializados; csv/parquet: tabelas normalizadas em solucao_ondas/")
+    parser.add_argument("--serve", action="store_true", help="modo serviço: pedidos JSON por linha no stdin, ondas de cada classe no stdout")
+    parser.add_argument("--metrics", help="arquivo JSON lines para tempos por etapa e contadores por iteração")
+    parser.add_argument("--profile", help="grava um perfil cProfile da execução neste arquivo")
+    parser.add_argument("--tracemalloc", action="store_true", help="mede o pico de memória de cada etapa")
+    parser.add_argument("--box-ils", action="store_true", help="ILS com custo pela área da caixa inteira (melhor para ondas pequenas)")
+    parser.add_argument("--time-budget", type=positive_seconds, help="orçamento total (s) de ILS + GRASP; devolve a melhor solução encontrada no prazo")
+    parser.add_argument("--seed", type=int, help="semente mestre; sem ela, uma semente é sorteada e registrada na saída e nas métricas")
+    args = parser.parse_args()
+    metrics = Metrics(args.metrics, trace_memory=args.tracemalloc, profile_path=args.profile)
+    
     # Arquivos de entrada
     caixas_csv = "data/caixas.csv"      # Colunas: ONDA_ID, CAIXA_ID, PECAS, CLASSE_ONDA, SKU
     estoque_csv = "data/estoque.csv"    # Colunas: ANDAR, CORREDOR, SKU, PECAS
     
+    if args.serve:
+        # Modo serviço: o processo e o pool de workers ficam ativos entre os pedidos
+        serve_json_lines(sys.stdin, sys.stdout, metrics=metrics)
+        metrics.close()
+        exit(0)
+    
+    if args.stream:
+        # Modo em fluxo: caixas lidas em blocos e processadas uma classe por vez
+        seed = args.seed if args.seed is not None else new_master_seed()
+        print(f"Semente da execução: {seed}")
+        metrics.emit("run", seed=seed)
+        with metrics.stage("stream"):
+            output_path = "solucao_ondas_final.csv" if args.output_format == "legado" else "solucao_ondas"
+            run_streaming_pipeline(caixas_csv, estoque_csv, None, output_path, output_format=args.output_format,
+                                   seed=seed)
+        metrics.close()
+        print(f"Tempo total de execução: {time.time() - start_time:.2f} segundos")
+        exit(0)
+    
     # Carrega os dados
-    caixas_df, estoque_df = load_data(caixas_csv, estoque_csv)
+    with metrics.stage("load"):
+        caixas_df, estoque_df = load_data(caixas_csv, estoque_csv)
     
     # Pré-processa os dados
-    boxes = preprocess_boxes(caixas_df)
-    stock = preprocess_stock(estoque_df)
+    with metrics.stage("preprocess"):
+        boxes = preprocess_boxes(caixas_df)
+        stock = preprocess_stock(estoque_df)
     
     print(f"Total de caixas agrupadas: {len(boxes)}")
     
@@ -500,16 +2278,51 @@ if __name__ == "__main__":
         for err in stock_errors:
             print(" -", err)
         save_validation_log("stock_validation.log", stock_errors)
+        metrics.close()
         exit(1)
     else:
         print("Validação inicial: Estoque global é suficiente para todas as caixas.")
     
-    # Solução inicial: alocação gulosa a nível de caixa
-    initial_solution, _ = allocate_boxes_greedy(boxes, stock)
-    print(f"Solução inicial (gulosa) gerada para {len(initial_solution)} alocações.")
-    
-    # Refinamento da solução com ILS (parâmetros reduzidos para teste)
-    refined_solution = ils_refine_solution(initial_solution, stock, max_iter=1, perturbation_strength=0.2)
+    # Solução inicial (gulosa) e refinamento com ILS, retomados do checkpoint quando
+    # os arquivos de entrada e os parâmetros não mudaram
+    ils_params = {"max_iter": 1, "perturbation_strength": 0.2, "box_level": args.box_ils}
+    wave_max_capacity = 6000
+    grasp_params = {"iterations": 2, "alpha": 0.3, "wave_capacity": wave_max_capacity, "local_search": True,
+                    "cluster_width": 8}
+    if args.time_budget is not None:
+        # Modo anytime: as iterações passam a ser limitadas pelo prazo e pela estagnação;
+        # o GRASP também aproveita o tempo que sobrar do ILS
+        ils_budget, grasp_budget = split_time_budget(args.time_budget)
+        ils_params.update(max_iter=None, time_limit=ils_budget, max_stall=20)
+        grasp_params.update(iterations=1000, time_limit=grasp_budget, max_stall=50)
+        budget_deadline = start_time + args.time_budget
+    # Semente mestre da execução: ILS e GRASP (por classe e por bloco) usam geradores
+    # derivados dela. A semente só entra na chave quando informada; sem --seed, o
+    # checkpoint é reaproveitado junto com a semente gravada nele, que é a informada
+    # na saída (checkpoints sem semente gravada são refeitos)
+    solution_key = checkpoint_key(file_digest(caixas_csv), file_digest(estoque_csv), "lote", ils_params, args.seed)
+    solution_checkpoint = os.path.join(CHECKPOINT_DIR, f"solucao_{solution_key}")
+    seed = args.seed if args.seed is not None else checkpoint_seed(solution_checkpoint)
+    refined_solution = None
+    if seed is None:
+        seed = new_master_seed()
+    else:
+        refined_solution = load_solution_checkpoint(solution_checkpoint)
+    print(f"Semente da execução: {seed}")
+    metrics.emit("run", seed=seed)
+    if refined_solution is not None:
+        print(f"Solução refinada carregada do checkpoint: {solution_checkpoint}")
+        metrics.emit("checkpoint", stage="ils", path=solution_checkpoint)
+    else:
+        # Solução inicial: alocação em lote por SKU (primeira posição que comporta a demanda)
+        with metrics.stage("greedy"):
+            initial_solution, _ = allocate_boxes_batch(boxes, stock)
+        print(f"Solução inicial (gulosa) gerada para {len(initial_solution)} alocações.")
+        
+        # Refinamento da solução com ILS (parâmetros reduzidos para teste)
+        with metrics.stage("ils", **ils_params):
+            refined_solution = ils_refine_solution(initial_solution, stock, metrics=metrics, rng=derive_rng(seed, "ils"), **ils_params)
+        save_solution_checkpoint(solution_checkpoint, refined_solution, seed)
     total_cost = cost_solution(refined_solution)
     print(f"Custo total (área) da solução refinada: {total_cost}")
     
@@ -529,20 +2342,44 @@ if __name__ == "__main__":
         save_validation_log("solution_validation.log", validation_errors)
     
     # Agrega as alocações por caixa para obter caixas únicas
-    aggregated_boxes = aggregate_boxes(refined_solution)
+    with metrics.stage("aggregate"):
+        aggregated_boxes = aggregate_boxes(refined_solution)
     print(f"Total de caixas únicas para agrupamento em ondas: {len(aggregated_boxes)}")
     
     # Agrupa as caixas em ondas usando GRASP em paralelo por classe
-    wave_max_capacity = 
     print(f"Capacidade máxima por onda: {wave_max_capacity}")
-    wave_solutions_by_class = parallel_grasp_grouping(aggregated_boxes, iterations=2, alpha=0.3, wave_capacity=wave_max_capacity, max_workers=4)
-    final_waves = []
-    for cls in wave_solutions_by_class:
-        final_waves.extend(wave_solutions_by_class[cls])
+    wave_checkpoint = os.path.join(CHECKPOINT_DIR, f"ondas_{checkpoint_key(solution_key, grasp_params, seed)}")
+    final_waves = load_wave_checkpoint(wave_checkpoint, aggregated_boxes)
+    table_writer = None
+    if final_waves is not None:
+        print(f"Ondas carregadas do checkpoint: {wave_checkpoint}")
+        metrics.emit("checkpoint", stage="grasp", path=wave_checkpoint)
+    else:
+        run_params = dict(grasp_params)
+        if args.time_budget is not None:
+            # O GRASP fica só com o que resta do orçamento total
+            run_params["time_limit"] = max(0.0, budget_deadline - time.time())
+        if args.output_format != "legado":
+            table_writer = WaveTableWriter("solucao_ondas", args.output_format)
+        final_waves = []
+        try:
+            with metrics.stage("grasp", **run_params):
+                for cls, waves in stream_grasp_grouping(aggregated_boxes, max_workers=4, seed=derive_seed(seed, "grasp"), **run_params):
+                    # Nas tabelas, cada classe é gravada assim que termina
+                    if table_writer is not None:
+                        table_writer.write(waves)
+                    final_waves.extend(waves)
+        finally:
+            if table_writer is not None:
+                table_writer.close()
+        # Ordem por classe, independente da ordem de conclusão (sort estável)
+        final_waves.sort(key=lambda wave: wave.wave_class)
+        save_wave_checkpoint(wave_checkpoint, final_waves)
     total_wave_area = sum(w.area() for w in final_waves)
     avg_wave_area = total_wave_area / len(final_waves) if final_waves else 0
     print(f"Total de ondas: {len(final_waves)}")
     print(f"Área média por onda: {avg_wave_area:.2f}")
+    metrics.emit("result", box_area=total_cost, waves=len(final_waves), wave_area=total_wave_area)
     
     # Validação final das ondas: cada caixa deve estar em uma única onda
     valid_waves, wave_errors = validate_final_waves(aggregated_boxes, final_waves, 6000)
@@ -553,10 +2390,19 @@ if __name__ == "__main__":
         summarize_errors(wave_errors)
         save_validation_log("waves_validation.log", wave_errors)
     
-    # Salva o CSV final de ondas
-    output_csv = "solucao_ondas_final.csv"
-    save_wave_solution(final_waves, output_csv)
+    # Salva a solução final de ondas (CSV legado ou tabelas normalizadas)
+    with metrics.stage("save"):
+        if args.output_format == "legado":
+            save_wave_solution(final_waves, "solucao_ondas_final.csv")
+        elif table_writer is None:
+            save_wave_tables(final_waves, "solucao_ondas", args.output_format)
+        else:
+            print(f"Tabelas de ondas salvas em: {', '.join(table_writer.paths.values())}")
     
     end_time = time.time()
     elapsed_time = end_time - start_time
+    # Acertos do cache de áreas por assinatura de corredores (só do processo principal)
+    metrics.emit("area_cache", **area_cache_stats())
+    metrics.emit("total", seconds=round(elapsed_time, 4))
+    metrics.close()
     print(f"Tempo total de execução: {elapsed_time:.2f} segundos")
@@ -0,0 +1,320 @@
+import random
+
+import ils_grasp
+
+# =============================================================================
+# Referência: área de um conjunto de alocações recalculada do zero (versão original)
+# =============================================================================
+def reference_area(corridors):
+    if not corridors:
+        return 0
+    unique_pairs = set((fl, corr) for fl, corr, _ in corridors)
+    sorted_corr = sorted(pair[1] for pair in unique_pairs)
+    actual_count = len(sorted_corr)
+    ideal_count = (sorted_corr[-1] - sorted_corr[0]) // 2 + 1
+    return actual_count if actual_count >= ideal_count else sorted_corr[-1] - sorted_corr[0]
+
+def random_allocations(rng, max_len=8, num_floors=3, num_corridors=60):
+    return [(rng.randrange(num_floors), rng.randint(1, num_corridors), rng.randint(1, 20))
+            for _ in range(rng.randint(0, max_len))]
+
+# =============================================================================
+# area_side memorizada por assinatura de corredores
+# =============================================================================
+def test_area_side_matches_reference():
+    rng = random.Random(0)
+    for _ in range(5000):
+        corridors = random_allocations(rng)
+        assert ils_grasp.area_side(corridors) == reference_area(corridors)
+
+def test_area_side_ignores_quantities_and_order():
+    rng = random.Random(1)
+    for _ in range(500):
+        corridors = random_allocations(rng)
+        shuffled = [(fl, corr, qty + 1) for fl, corr, qty in corridors]
+        rng.shuffle(shuffled)
+        assert ils_grasp.corridor_signature(corridors) == ils_grasp.corridor_signature(shuffled)
+        assert ils_grasp.area_side(corridors) == ils_grasp.area_side(shuffled)
+
+def test_area_side_cache_hit_on_repeated_signature():
+    corridors = [(0, 12, 3), (1, 40, 5), (0, 12, 1)]
+    ils_grasp.area_side(corridors)
+    before = ils_grasp.area_cache_stats()
+    ils_grasp.area_side([(1, 40, 9), (0, 12, 2)])
+    after = ils_grasp.area_cache_stats()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+# =============================================================================
+# Wave: multiconjunto de corredores e bitsets contra o recálculo do zero
+# =============================================================================
+def random_pairs(rng, max_len=5, num_floors=3, num_corridors=60):
+    return [(rng.randrange(num_floors), rng.randint(1, num_corridors)) for _ in range(rng.randint(0, max_len))]
+
+def wave_reference_area(wave, pairs):
+    return reference_area([(fl, corr, 1) for entry in wave.boxes for fl, corr in pairs[entry]])
+
+def assert_wave_consistent(wave, pairs):
+    visited = {(fl, corr) for entry in wave.boxes for fl, corr in pairs[entry]}
+    assert set(wave.corridor_counts) == visited
+    assert wave.corridor_mask == sum(1 << corr for corr in {corr for _, corr in visited})
+    for fl, mask in wave.floor_masks.items():
+        assert mask == sum(1 << corr for f, corr in visited if f == fl)
+    assert wave.area() == wave_reference_area(wave, pairs)
+
+def test_wave_random_operations_match_reference():
+    rng = random.Random(2)
+    for _ in range(200):
+        pairs = [random_pairs(rng) for _ in range(30)]
+        waves = [ils_grasp.Wave("C"), ils_grasp.Wave("C")]
+        outside = list(range(len(pairs)))
+        for _ in range(60):
+            wave = rng.choice(waves)
+            if outside and (not wave.boxes or rng.random() < 0.6):
+                entry = outside.pop(rng.randrange(len(outside)))
+                members = wave.boxes + [entry]
+                expected = reference_area([(fl, corr, 1) for e in members for fl, corr in pairs[e]]) - wave.area()
+                assert wave.incremental_area_masks(*ils_grasp.pair_masks(pairs[entry])) == expected
+                wave.add_entry(entry, 1, pairs[entry])
+            elif wave.boxes and rng.random() < 0.9:
+                entry = rng.choice(wave.boxes)
+                expected = reference_area([(fl, corr, 1) for e in wave.boxes if e != entry for fl, corr in pairs[e]])
+                assert wave.area_after(removed=pairs[entry]) == expected
+                wave.remove_entry(entry, 1, pairs[entry])
+                outside.append(entry)
+            else:
+                source = waves[1] if wave is waves[0] else waves[0]
+                wave.absorb(source)
+                assert not source.boxes and source.area() == 0
+            for w in waves:
+                assert_wave_consistent(w, pairs)
+
+def test_wave_area_after_swap_matches_reference():
+    rng = random.Random(3)
+    for _ in range(2000):
+        pairs = [random_pairs(rng) for _ in range(8)]
+        wave = ils_grasp.Wave("C")
+        for entry in range(6):
+            wave.add_entry(entry, 1, pairs[entry])
+        out, into = rng.randrange(6), rng.randrange(6, 8)
+        members = [e for e in wave.boxes if e != out] + [into]
+        expected = reference_area([(fl, corr, 1) for e in members for fl, corr in pairs[e]])
+        # area_after só simula a troca: a onda não pode mudar
+        before = (dict(wave.corridor_counts), dict(wave.floor_masks), wave.corridor_mask, wave.area())
+        assert wave.area_after(removed=pairs[out], added=pairs[into]) == expected
+        assert before == (wave.corridor_counts, wave.floor_masks, wave.corridor_mask, wave.area())
+
+# =============================================================================
+# Alocação em lote: FirstFitIndex e allocate_sku_batch
+# =============================================================================
+def test_first_fit_index_matches_linear_scan():
+    rng = random.Random(5)
+    for _ in range(300):
+        balances = [rng.randint(0, 30) for _ in range(rng.randint(0, 20))]
+        index = ils_grasp.FirstFitIndex(balances)
+        for _ in range(40):
+            qty = rng.randint(0, 35)
+            expected = next((i for i, b in enumerate(balances) if b >= qty), None)
+            assert index.first_fit(qty) == expected
+            if expected is not None:
+                taken = rng.randint(0, qty)
+                index.take(expected, taken)
+                balances[expected] -= taken
+            assert index.remaining() == balances
+
+def test_allocate_sku_batch_serves_every_demand():
+    rng = random.Random(6)
+    for _ in range(300):
+        # Até 40 posições: SKUs pequenos usam a varredura linear, os demais a árvore
+        entries = [(rng.randrange(2), rng.randint(1, 40), rng.randint(1, 15)) for _ in range(rng.randint(1, 40))]
+        total = sum(qty for _, _, qty in entries)
+        demands = []
+        while sum(demands) < total // 2:
+            demands.append(min(rng.randint(0, 10), total - sum(demands)))
+        preferred = [{rng.randint(1, 40) for _ in range(3)} for _ in demands]
+        allocations, remaining = ils_grasp.allocate_sku_batch("S", entries, demands, preferred)
+        used = {}
+        for required, allocation in zip(demands, allocations):
+            assert sum(qty for _, _, qty in allocation) == required
+            for fl, corr, qty in allocation:
+                used[(fl, corr)] = used.get((fl, corr), 0) + qty
+        taken = {}
+        for (fl, corr, qty), balance in zip(entries, remaining):
+            assert balance >= 0
+            taken[(fl, corr)] = taken.get((fl, corr), 0) + qty - balance
+        assert {pos: qty for pos, qty in taken.items() if qty} == {pos: qty for pos, qty in used.items() if qty}
+
+def test_allocate_sku_linear_matches_tree():
+    rng = random.Random(7)
+    for _ in range(300):
+        entries = [(rng.randrange(2), rng.randint(1, 20), rng.randint(0, 15)) for _ in range(rng.randint(1, 12))]
+        demands = [rng.randint(0, 8) for _ in range(rng.randint(1, 15))]
+        if sum(demands) > sum(qty for _, _, qty in entries):
+            continue
+        preferred = [{rng.randint(1, 20) for _ in range(3)} for _ in demands]
+        linear = ils_grasp.allocate_sku_linear("S", entries, demands, preferred)
+        limit, ils_grasp.LINEAR_SCAN_POSITIONS = ils_grasp.LINEAR_SCAN_POSITIONS, 0
+        try:
+            tree = ils_grasp.allocate_sku_batch("S", entries, demands, preferred)
+        finally:
+            ils_grasp.LINEAR_SCAN_POSITIONS = limit
+        assert linear == (tree[0], list(tree[1]))
+
+def test_allocate_boxes_batch_zero_demand_without_stock():
+    boxes = [{"caixa_id": 1, "classe_onda": "C", "items": {"SKU_X": 0}}]
+    solution, _ = ils_grasp.allocate_boxes_batch(boxes, {})
+    assert solution[0]["allocations"] == []
+
+# =============================================================================
+# ILS: custo incremental e registro de desfazer de SolutionState
+# =============================================================================
+def small_instance(seed, num_boxes=40, num_skus=30):
+    rng = random.Random(seed)
+    stock = {f"SKU_{k}": [(rng.randrange(2), rng.randint(1, 50), rng.randint(160, 200)) for _ in range(rng.randint(1, 4))]
+             for k in range(num_skus)}
+    boxes = [{"caixa_id": b, "classe_onda": f"C{rng.randint(1, 3)}",
+              "items": {sku: rng.randint(1, 4) for sku in rng.sample(sorted(stock), rng.randint(1, 4))}}
+             for b in range(1, num_boxes + 1)]
+    return boxes, stock
+
+def ledger_usage(ledger):
+    return {sku: {pos: qty for pos, qty in positions.items() if qty} for sku, positions in ledger.allocated.items()
+            if any(positions.values())}
+
+def test_solution_state_undo_log_restores_best():
+    for seed in range(20):
+        rng = random.Random(seed)
+        boxes, stock = small_instance(seed)
+        solution, _ = ils_grasp.allocate_boxes_greedy(boxes, stock)
+        for state_class in (ils_grasp.SolutionState, ils_grasp.BoxSolutionState):
+            rows = [dict(entry) for entry in solution]
+            state = state_class(rows, stock)
+            best = [entry["allocations"] for entry in rows]
+            best_cost = state.total_cost
+            for _ in range(30):
+                idx = rng.randrange(len(rows))
+                sku = rows[idx]["sku"]
+                fl, corr, _ = rng.choice(stock[sku])
+                state.assign(idx, [(fl, corr, rows[idx]["required"])])
+                if state_class is ils_grasp.SolutionState:
+                    assert state.total_cost == ils_grasp.cost_solution(rows)
+                else:
+                    assert state.total_cost == sum(ils_grasp.area_side(box["corridors"])
+                                                   for box in ils_grasp.aggregate_boxes(rows))
+                if rng.random() < 0.2:
+                    state.commit_best()
+                    best = [entry["allocations"] for entry in rows]
+                    best_cost = state.total_cost
+            state.restore_best()
+            assert [entry["allocations"] for entry in rows] == best
+            assert state.total_cost == best_cost
+            assert ledger_usage(state.ledger) == ledger_usage(ils_grasp.StockLedger(stock, rows))
+            assert state.signatures == [ils_grasp.corridor_signature(entry["allocations"]) for entry in rows]
+
+# =============================================================================
+# GRASP: busca local sobre as ondas
+# =============================================================================
+def test_grasp_local_search_is_valid_and_never_worse():
+    for seed in range(30):
+        rng = random.Random(seed)
+        boxes, stock = small_instance(seed, num_boxes=60)
+        solution, _ = ils_grasp.allocate_boxes_greedy(boxes, stock)
+        aggregated = ils_grasp.aggregate_boxes(solution)
+        for box in aggregated:
+            box["classe_onda"] = rng.choice("AB")
+        capacity = rng.choice([20, 40, 80])
+        results = {}
+        for local_search in (False, True):
+            waves = ils_grasp.grasp_group_boxes_into_waves(aggregated, iterations=4, wave_capacity=capacity,
+                                                           local_search=local_search, rng=random.Random(seed))
+            results[local_search] = waves
+        waves = results[True]
+        assert sorted(box["caixa_id"] for wave in waves for box in wave.boxes) == sorted(box["caixa_id"] for box in aggregated)
+        for wave in waves:
+            assert wave.total_pieces == sum(box["pieces"] for box in wave.boxes) <= capacity
+            assert {box["classe_onda"] for box in wave.boxes} == {wave.wave_class}
+        # A busca local não sorteia nada: as construções são as mesmas com e sem ela
+        assert ils_grasp.wave_solution_cost(waves) <= ils_grasp.wave_solution_cost(results[False])
+        assert sum(wave.area() for wave in waves) <= sum(wave.area() for wave in results[False])
+
+# =============================================================================
+# Replanejamento incremental
+# =============================================================================
+def wave_snapshot(waves):
+    return [([box["caixa_id"] for box in w.boxes], w.total_pieces, dict(w.corridor_counts), w.area()) for w in waves]
+
+def test_replan_incremental_is_valid_and_keeps_inputs():
+    for seed in range(10):
+        rng = random.Random(seed)
+        boxes, stock = small_instance(seed, num_boxes=60)
+        old_boxes, new_boxes = boxes[:-8], boxes[-8:]
+        solution, _ = ils_grasp.allocate_boxes_greedy(old_boxes, {sku: list(e) for sku, e in stock.items()})
+        waves = ils_grasp.grasp_group_boxes_into_waves(ils_grasp.aggregate_boxes(solution), iterations=1,
+                                                       wave_capacity=40, rng=rng)
+        deltas = []
+        for entry in rng.sample(solution, 5):
+            fl, corr, qty = entry["allocations"][0]
+            deltas.append((entry["sku"], fl, corr, -qty))
+        solution_before = [dict(entry) for entry in solution]
+        stock_before = {sku: list(entries) for sku, entries in stock.items()}
+        waves_before = wave_snapshot(waves)
+        new_solution, new_waves, new_stock = ils_grasp.replan_incremental(solution, waves, stock, new_boxes=new_boxes,
+                                                                          stock_deltas=deltas, wave_capacity=40, rng=rng)
+        assert solution == solution_before
+        assert stock == stock_before
+        assert wave_snapshot(waves) == waves_before
+        assert ils_grasp.validate_solution(boxes, new_solution, new_stock)[0]
+        assert ils_grasp.validate_final_waves(ils_grasp.aggregate_boxes(new_solution), new_waves, 40)[0]
+
+def test_wave_copy_is_independent():
+    rng = random.Random(4)
+    pairs = [random_pairs(rng) for _ in range(6)]
+    wave = ils_grasp.Wave("C")
+    for entry in range(4):
+        wave.add_entry(entry, 1, pairs[entry])
+    copy = wave.copy()
+    copy.add_entry(4, 1, pairs[4])
+    copy.remove_entry(0, 1, pairs[0])
+    assert wave.boxes == [0, 1, 2, 3]
+    assert_wave_consistent(wave, pairs)
+    assert_wave_consistent(copy, pairs)
+
+# =============================================================================
+# Saída em tabelas normalizadas
+# =============================================================================
+def test_wave_tables_ids_do_not_depend_on_class_order(tmp_path):
+    boxes, stock = small_instance(5)
+    solution, _ = ils_grasp.allocate_boxes_greedy(boxes, stock)
+    aggregated = ils_grasp.aggregate_boxes(solution)
+    for box in aggregated:
+        box["classe_onda"] = f"C{box['caixa_id'] % 2}"
+    waves = ils_grasp.grasp_group_boxes_into_waves(aggregated, iterations=2, wave_capacity=40, rng=random.Random(5))
+    rows = {}
+    for name, order in (("ordenado", sorted), ("invertido", lambda w: sorted(w, reverse=True))):
+        by_class = order({wave.wave_class for wave in waves})
+        ils_grasp.save_wave_tables([w for cls in by_class for w in waves if w.wave_class == cls], tmp_path / name)
+        with open(tmp_path / name / "ondas.csv", encoding="utf-8") as f:
+            rows[name] = sorted(f.readlines()[1:])
+    assert rows["ordenado"] == rows["invertido"]
+    assert len(rows["ordenado"]) == len(aggregated)
+
+# =============================================================================
+# Checkpoints binários (.npy + meta.json)
+# =============================================================================
+def test_checkpoints_round_trip(tmp_path):
+    for seed, box_id in ((6, int), (7, lambda b: f"CX-{b}")):
+        boxes, stock = small_instance(seed)
+        for box in boxes:
+            box["caixa_id"] = box_id(box["caixa_id"])
+        solution, _ = ils_grasp.allocate_boxes_greedy(boxes, stock)
+        aggregated = ils_grasp.aggregate_boxes(solution)
+        waves = ils_grasp.grasp_group_boxes_into_waves(aggregated, iterations=2, wave_capacity=40, rng=random.Random(seed))
+        solution_dir, wave_dir = str(tmp_path / f"solucao_{seed}"), str(tmp_path / f"ondas_{seed}")
+        ils_grasp.save_solution_checkpoint(solution_dir, solution, seed)
+        ils_grasp.save_wave_checkpoint(wave_dir, waves)
+        loaded = ils_grasp.load_solution_checkpoint(solution_dir)
+        assert [dict(entry, allocations=list(entry["allocations"])) for entry in solution] == loaded
+        assert ils_grasp.checkpoint_seed(solution_dir) == seed
+        loaded_waves = ils_grasp.load_wave_checkpoint(wave_dir, ils_grasp.aggregate_boxes(loaded))
+        assert [w.wave_class for w in loaded_waves] == [w.wave_class for w in waves]
+        assert wave_snapshot(loaded_waves) == wave_snapshot(waves)